@@ -0,0 +1,74 @@
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from autogen_simfile_bpms import AudioBeatsToBPMs, atbpm_kwargs_from_args, build_argument_parser
+from autogen_bpms_server import DEFAULT_TOKEN_PATH, PATH_KWARGS
+
+
+DEFAULT_SERVER_URL = "http://127.0.0.1:8765"
+
+
+def submit_job(server_url: str, job: dict, token: str, busy_timeout_sec: float = 0.) -> dict:
+    """
+    Send a job to a running autogen_bpms_server.py and wait for its result.  While the server is busy,
+    retry for up to busy_timeout_sec seconds.
+    """
+    request_data = json.dumps(job).encode()
+    deadline = time.monotonic() + busy_timeout_sec
+    while True:
+        request = urllib.request.Request(server_url.rstrip("/") + "/jobs", data=request_data,
+                                         headers={"Content-Type": "application/json",
+                                                  "Authorization": "Bearer {}".format(token)}, method="POST")
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code != 503 or time.monotonic() >= deadline:
+                raise RuntimeError("Server error {}: {}".format(e.code, e.read().decode(errors="replace")))
+            time.sleep(float(e.headers.get("Retry-After", 1)))
+
+
+def main():
+    parser = build_argument_parser()
+    parser.description = "Same options as autogen_simfile_bpms.py, but the job runs on a running " \
+                         "autogen_bpms_server.py, which keeps the Vamp plugin host warm between jobs"
+    parser.add_argument("--server_url", help="(OPTIONAL) URL of the server.  Default is {}".format(DEFAULT_SERVER_URL),
+                        default=DEFAULT_SERVER_URL)
+    parser.add_argument("--busy_timeout_sec", help="(OPTIONAL) How long to keep retrying while the server is busy "
+                                                   "with other jobs.  Default is to give up immediately",
+                        type=float, default=0.)
+    parser.add_argument("--token_path", help="(OPTIONAL) File with the server's access token.  "
+                                             "Default is {}".format(DEFAULT_TOKEN_PATH),
+                        default=DEFAULT_TOKEN_PATH)
+    args = parser.parse_args()
+
+    kwargs = atbpm_kwargs_from_args(args)
+    # Check the inputs and ask about overwriting here, the same way the standalone program does,
+    # since the server never prompts
+    atbpm = AudioBeatsToBPMs(**kwargs)
+    kwargs["output_simfile_path"] = atbpm.output_simfile_path
+    kwargs["overwrite_input_simfile"] = False
+    for key in PATH_KWARGS:
+        if kwargs.get(key) is not None:
+            kwargs[key] = os.path.abspath(kwargs[key])  # The server's working directory may differ
+
+    name = os.path.basename(kwargs["input_beats_path"] or kwargs["input_audio_path"])
+    with open(args.token_path, "r") as infile:
+        token = infile.read().strip()
+    result = submit_job(args.server_url, {"name": name, "kwargs": kwargs}, token, args.busy_timeout_sec)
+    if result["status"] != "ok":
+        print(result.get("traceback") or result["error"], file=sys.stderr)
+        sys.exit(1)
+    print("#OFFSET:{};".format(result["offset"]))
+    print("#BPMS:{};".format(result["simfile_bpms"]))
+    for key in ["output_simfile_path", "output_txt_path", "output_beat_markers_bpms_csv_path", "output_beats_path"]:
+        if kwargs.get(key) is not None:
+            print("Wrote {}".format(kwargs[key]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import argparse
+import hmac
+import inspect
+import ipaddress
+import json
+import os
+import pathlib
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from warnings import warn
+
+from autogen_simfile_bpms import AudioBeatsToBPMs, BeatTimestampCache, split_plugin_identifier
+from autogen_pack_bpms import run_song_job
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_TOKEN_PATH = BeatTimestampCache.DEFAULT_CACHE_DIR / "server_token"
+# AudioBeatsToBPMs arguments that a job may set; the rest only make sense in-process
+JOB_KWARGS = set(inspect.signature(AudioBeatsToBPMs.__init__).parameters) - \
+    {"self", "audio", "sampling_rate", "beats", "interactive", "metrics_callbacks"}
+# Job arguments that are paths, all of which must be under the server's root directory
+PATH_KWARGS = ["input_audio_path", "input_beats_path", "input_simfile_path", "output_simfile_path",
+               "output_txt_path", "output_beat_markers_bpms_csv_path", "output_beats_path", "metrics_json_path",
+               "cache_dir", "compare_output_dir"]
+
+# Plugins loaded once in each worker process and never used, so that their libraries stay resident and jobs
+# don't pay for loading them; each job still creates its own plugin instance
+_warm_plugins = []
+
+
+def is_loopback_host(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def write_token_file(token_path) -> str:
+    """
+    Write a new random token to token_path, readable by the current user only.
+
+    :return: the token
+    """
+    token_path = pathlib.Path(token_path)
+    token_path.parent.mkdir(parents=True, exist_ok=True)
+    token = secrets.token_urlsafe(32)
+    file_descriptor = os.open(str(token_path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(file_descriptor, 0o600)  # In case the file already existed with other permissions
+    with os.fdopen(file_descriptor, "w") as outfile:
+        outfile.write(token)
+    return token
+
+
+def _warm_up_worker(plugin_identifiers):
+    # Pay for the imports, the Vamp plugin discovery and the plugin library loading once per worker,
+    # instead of once per job.  Only the libraries are shared with the jobs, not the plugin instances
+    try:
+        import soundfile  # noqa: F401
+        import simfile  # noqa: F401
+        import vamp  # noqa: F401
+        import vampyhost
+        for plugin_key in dict.fromkeys(split_plugin_identifier(plugin_identifier)[0]
+                                        for plugin_identifier in plugin_identifiers):
+            _warm_plugins.append(vampyhost.load_plugin(plugin_key, 44100, vampyhost.ADAPT_NONE))
+    except Exception as e:
+        warn("WARNING: Could not warm up the worker ({}: {}); jobs will still run, "
+             "but the first one may be slower.".format(type(e).__name__, e))
+
+
+class TimingServer(ThreadingHTTPServer):
+    """
+    Local HTTP server that runs AudioBeatsToBPMs jobs on a pool of warm worker processes.  At most
+    workers + queue_size jobs are accepted at a time; past that, requests are turned away with 503 so that
+    clients back off instead of piling up.  Requests must carry the token as "Authorization: Bearer <token>",
+    and every path in a job must be under root_dir, since the server writes wherever the job says.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, workers: int, queue_size: int, plugin_identifiers, token: str, root_dir):
+        super().__init__(server_address, _TimingRequestHandler)
+        self.token = token
+        self.root_dir = pathlib.Path(os.path.realpath(root_dir))
+        self.workers = workers
+        self.max_jobs = workers + queue_size
+        self.job_slots = threading.BoundedSemaphore(self.max_jobs)
+        self.num_jobs = 0
+        self.num_jobs_lock = threading.Lock()
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_warm_up_worker,
+                                            initargs=(list(plugin_identifiers),))
+
+    def is_authorized(self, authorization: str) -> bool:
+        return hmac.compare_digest((authorization or "").encode(), "Bearer {}".format(self.token).encode())
+
+    def check_job_paths(self, kwargs: dict):
+        for key in PATH_KWARGS:
+            if kwargs.get(key) is None:
+                continue
+            if not isinstance(kwargs[key], str) or not os.path.isabs(kwargs[key]):
+                raise ValueError("Job option {} must be an absolute path".format(key))
+            # realpath resolves symlinks, so a link under the root can't point the job outside of it
+            if not pathlib.Path(os.path.realpath(kwargs[key])).is_relative_to(self.root_dir):
+                raise PermissionError("Job option {} {} is outside of the server's root directory {}"
+                                      "".format(key, kwargs[key], self.root_dir))
+
+    def run_job(self, job: dict):
+        """
+        :return: the job's result, or None if the server is already at capacity
+        """
+        if not self.job_slots.acquire(blocking=False):
+            return None
+        with self.num_jobs_lock:
+            self.num_jobs += 1
+        try:
+            return self.executor.submit(run_song_job, job).result()
+        finally:
+            with self.num_jobs_lock:
+                self.num_jobs -= 1
+            self.job_slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(cancel_futures=True)
+
+
+class _TimingRequestHandler(BaseHTTPRequestHandler):
+    server: TimingServer
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _check_authorization(self) -> bool:
+        if self.server.is_authorized(self.headers.get("Authorization")):
+            return True
+        self._send_json(401, {"error": "Missing or wrong token"}, headers={"WWW-Authenticate": "Bearer"})
+        return False
+
+    def do_GET(self):
+        if not self._check_authorization():
+            return
+        if self.path != "/health":
+            self._send_json(404, {"error": "Unknown path {}".format(self.path)})
+            return
+        self._send_json(200, {"status": "ok", "workers": self.server.workers, "jobs": self.server.num_jobs,
+                              "max_jobs": self.server.max_jobs})
+
+    def do_POST(self):
+        if not self._check_authorization():
+            return
+        if self.path != "/jobs":
+            self._send_json(404, {"error": "Unknown path {}".format(self.path)})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            kwargs = job["kwargs"]
+            unknown_kwargs = set(kwargs) - JOB_KWARGS
+            if unknown_kwargs:
+                raise ValueError("Unknown job options {}".format(", ".join(sorted(unknown_kwargs))))
+            self.server.check_job_paths(kwargs)
+            job = {"name": str(job.get("name", "job")), "kwargs": kwargs}
+        except PermissionError as e:
+            self._send_json(403, {"error": "Invalid job: {}".format(e)})
+            return
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self._send_json(400, {"error": "Invalid job: {}".format(e)})
+            return
+        try:
+            result = self.server.run_job(job)
+        except BrokenProcessPool as e:
+            self._send_json(500, {"error": "Worker pool is broken: {}".format(e)})
+            return
+        if result is None:
+            self._send_json(503, {"error": "Server is busy, {} jobs are already running or queued"
+                                           "".format(self.server.max_jobs)}, headers={"Retry-After": "1"})
+            return
+        self._send_json(200, result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve AutogenSimfileBPMs jobs on localhost, keeping the Vamp "
+                                                 "plugin host warm between jobs.  Submit jobs with "
+                                                 "autogen_bpms_client.py")
+    parser.add_argument("--host", help="(OPTIONAL) Loopback address to listen on.  Default is {}"
+                                       "".format(DEFAULT_HOST),
+                        default=DEFAULT_HOST)
+    parser.add_argument("--port", help="(OPTIONAL) Port to listen on.  Default is {}".format(DEFAULT_PORT),
+                        type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", help="(OPTIONAL) Number of worker processes.  Default is the number of CPUs",
+                        type=int)
+    parser.add_argument("--queue_size", help="(OPTIONAL) Number of jobs that may wait for a free worker before "
+                                             "the server starts turning jobs away.  Default is twice the number "
+                                             "of workers",
+                        type=int)
+    parser.add_argument("--plugin_identifiers", help="(OPTIONAL) Vamp plugins ('library:plugin' or "
+                                                     "'library:plugin:output') whose libraries each worker loads "
+                                                     "at startup.  Default is {}"
+                                                     "".format(AudioBeatsToBPMs.PLUGIN_IDENTIFIER),
+                        nargs="+", default=[AudioBeatsToBPMs.PLUGIN_IDENTIFIER])
+    parser.add_argument("--root_dir", help="(OPTIONAL) Only accept jobs whose input and output paths are under this "
+                                           "directory.  Default is the current directory",
+                        default=os.getcwd())
+    parser.add_argument("--token_path", help="(OPTIONAL) File where a new access token is written at startup, "
+                                             "readable by the current user only; clients read it from there.  "
+                                             "Default is {}".format(DEFAULT_TOKEN_PATH),
+                        default=DEFAULT_TOKEN_PATH)
+    args = parser.parse_args()
+    if not is_loopback_host(args.host):
+        parser.error("--host must be a loopback address, since anyone who can reach the server can make it write "
+                     "files")
+    if not os.path.isdir(args.root_dir):
+        parser.error("--root_dir {} is not a directory".format(args.root_dir))
+
+    workers = args.workers if args.workers is not None else os.cpu_count()
+    queue_size = args.queue_size if args.queue_size is not None else 2 * workers
+    token = write_token_file(args.token_path)
+    server = TimingServer((args.host, args.port), workers, queue_size, args.plugin_identifiers, token,
+                          args.root_dir)
+    print("Serving on http://{}:{} with {} workers, for paths under {}; the access token is in {}".format(
+        args.host, args.port, workers, server.root_dir, args.token_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping server.")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import argparse
+import csv
+import json
+import os
+import pathlib
+import re
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+from warnings import warn
+
+from autogen_simfile_bpms import AudioBeatsToBPMs, MetricsAggregator
+
+
+AUDIO_EXTENSIONS = [".ogg", ".wav", ".flac", ".mp3", ".opus", ".oga", ".aiff"]
+SIMFILE_EXTENSIONS = [".ssc", ".sm"]  # Prefer .ssc over .sm when a song folder has both
+MANIFEST_PATH_COLUMNS = ["input_audio_path", "input_beats_path", "input_simfile_path", "output_simfile_path",
+                         "output_txt_path", "output_beat_markers_bpms_csv_path", "output_beats_path"]
+DEFAULT_SUMMARY_FILENAME = "autogen_bpms_summary.json"
+
+
+def _find_simfile(song_dir: pathlib.Path):
+    for extension in SIMFILE_EXTENSIONS:
+        candidates = sorted(song_dir.glob("*" + extension))
+        if candidates:
+            return candidates[0]
+    return None
+
+
+def _find_audio(song_dir: pathlib.Path, simfile_path: pathlib.Path = None):
+    if simfile_path is not None:
+        # Use the simfile's #MUSIC tag if it points at an existing file, so preview clips etc. are skipped
+        with open(simfile_path, "r", encoding="utf-8", errors="replace") as infile:
+            match = re.search(r"#MUSIC:([^;]*);", infile.read())
+        if match is not None and match.group(1).strip():
+            music_path = song_dir / match.group(1).strip()
+            if music_path.is_file():
+                return music_path
+    candidates = sorted(path for path in song_dir.iterdir() if path.suffix.lower() in AUDIO_EXTENSIONS)
+    return candidates[0] if candidates else None
+
+
+def find_pack_jobs(pack_dir, output_dir=None, overwrite_input_simfiles=False) -> List[dict]:
+    pack_dir = pathlib.Path(pack_dir)
+    if not pack_dir.is_dir():
+        raise ValueError("{} is not a valid pack directory".format(pack_dir))
+    output_dir = pathlib.Path(output_dir) if output_dir is not None else None
+    jobs = []
+    for song_dir in sorted(path for path in pack_dir.iterdir() if path.is_dir()):
+        simfile_path = _find_simfile(song_dir)
+        audio_path = _find_audio(song_dir, simfile_path)
+        if audio_path is None:
+            warn("WARNING: No audio file found in {}, skipping this song folder.".format(song_dir))
+            continue
+        kwargs = {"input_audio_path": str(audio_path)}
+        if simfile_path is not None:
+            kwargs["input_simfile_path"] = str(simfile_path)
+            if overwrite_input_simfiles:
+                kwargs["overwrite_input_simfile"] = True
+            elif output_dir is not None:
+                kwargs["output_simfile_path"] = str(output_dir / song_dir.name / simfile_path.name)
+        if output_dir is not None:
+            kwargs["output_txt_path"] = str(output_dir / song_dir.name / (audio_path.stem + ".txt"))
+        jobs.append({"name": song_dir.name, "kwargs": kwargs})
+    return jobs
+
+
+def load_manifest_jobs(manifest_path) -> List[dict]:
+    """
+    Read a CSV manifest with a header row, one song per row.  The columns are named after the
+    AudioBeatsToBPMs arguments (input_audio_path, input_beats_path, input_beats_sampling_rate,
+    input_simfile_path, output_simfile_path, output_txt_path, output_beat_markers_bpms_csv_path,
+    output_beats_path),
+    plus an optional "name" column.  Relative paths are relative to the manifest's directory.
+
+    :return:
+    """
+    manifest_path = pathlib.Path(manifest_path)
+    jobs = []
+    with open(manifest_path, "r", newline="") as infile:
+        for row_number, row in enumerate(csv.DictReader(infile)):
+            kwargs = {}
+            for column in MANIFEST_PATH_COLUMNS:
+                if row.get(column):
+                    kwargs[column] = str(manifest_path.parent / row[column])
+            if row.get("input_beats_sampling_rate"):
+                kwargs["input_beats_sampling_rate"] = int(row["input_beats_sampling_rate"])
+            name = row.get("name") or pathlib.Path(kwargs.get("input_audio_path", kwargs.get("input_beats_path",
+                                                                                              str(row_number)))).stem
+            jobs.append({"name": name, "kwargs": kwargs})
+    return jobs
+
+
+def run_song_job(job: dict) -> dict:
+    result = {"name": job["name"], "status": "ok", "error": None}
+    result.update(job["kwargs"])
+    start_time = time.perf_counter()
+    try:
+        for output_key in ["output_simfile_path", "output_txt_path", "output_beat_markers_bpms_csv_path",
+                           "output_beats_path"]:
+            if job["kwargs"].get(output_key) is not None:
+                pathlib.Path(job["kwargs"][output_key]).parent.mkdir(parents=True, exist_ok=True)
+        atbpm = AudioBeatsToBPMs(**job["kwargs"], interactive=False)
+        atbpm.run()
+        if atbpm.simfile_bpms is None:
+            atbpm.convert_bpms_to_simfile_format()
+        result["offset"] = atbpm.offset
+        result["simfile_bpms"] = atbpm.simfile_bpms
+        result["num_bpms"] = len(atbpm.bpms_data.bpms)
+        result["beats_from_cache"] = atbpm.beats_from_cache
+        result["beat_tracking_path"] = atbpm.beat_tracking_path
+        result["tempo_prepass"] = atbpm.tempo_prepass_report
+        result["bpm_compaction"] = atbpm.bpm_compaction_report
+        result["metrics"] = atbpm.metrics.to_dict()
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+        result["traceback"] = traceback.format_exc()
+    result["elapsed_sec"] = time.perf_counter() - start_time
+    return result
+
+
+def run_batch(jobs: List[dict], workers: int = None, summary_path=None) -> List[dict]:
+    workers = workers if workers is not None else os.cpu_count()
+    results = []
+
+    def record(result: dict):
+        results.append(result)
+        print("[{}/{}] {}: {}".format(len(results), len(jobs), result["name"],
+                                      result["status"] if result["error"] is None else result["error"]))
+
+    try:
+        # A worker that dies (a crash in the Vamp plugin, or killed for running out of memory) breaks the pool
+        # and fails every job that hadn't finished, so those jobs are run again, each in a process of its own
+        lost_jobs = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_song_job, job): job for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    record(future.result())
+                except BrokenProcessPool:
+                    lost_jobs.append(futures[future])
+        if lost_jobs:
+            warn("WARNING: A worker process died, running the {} unfinished jobs again one process each."
+                 "".format(len(lost_jobs)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in as_completed([executor.submit(_run_song_job_in_own_process, job)
+                                            for job in lost_jobs]):
+                    record(future.result())
+    finally:
+        results.sort(key=lambda result: result["name"])
+        if summary_path is not None:
+            write_summary(results, summary_path)
+    return results
+
+
+def _run_song_job_in_own_process(job: dict) -> dict:
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            return executor.submit(run_song_job, job).result()
+        except BrokenProcessPool:
+            result = {"name": job["name"], "status": "error",
+                      "error": "Worker process died while running the job; it may have crashed in the Vamp "
+                               "plugin or run out of memory",
+                      "traceback": None, "elapsed_sec": 0.}
+            result.update(job["kwargs"])
+            return result
+
+
+def write_summary(results: List[dict], summary_path):
+    metrics_aggregator = MetricsAggregator()
+    for result in results:
+        if result.get("metrics") is not None:
+            metrics_aggregator(result["metrics"])
+    summary = {"num_jobs": len(results),
+               "num_ok": sum(result["status"] == "ok" for result in results),
+               "num_errors": sum(result["status"] == "error" for result in results),
+               "total_elapsed_sec": sum(result["elapsed_sec"] for result in results),
+               "beat_tracking_paths": dict(Counter(result["beat_tracking_path"] for result in results
+                                                   if result.get("beat_tracking_path") is not None)),
+               "metrics": metrics_aggregator.to_dict(),
+               "jobs": results}
+    with open(summary_path, "w") as outfile:
+        json.dump(summary, outfile, indent=2)
+    print("Summary written to {}".format(summary_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run AutogenSimfileBPMs over every song in a pack, in parallel")
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument("--pack_dir", help="Path to a pack directory containing one folder per song, each with "
+                                           "an audio file and (optionally) an .sm or .ssc file")
+    inputs.add_argument("--manifest_path", help="Path to a CSV manifest with one song per row; the header columns "
+                                                "are named after the single-song options, e.g. input_audio_path, "
+                                                "input_simfile_path, output_simfile_path")
+    parser.add_argument("--output_dir", help="(OPTIONAL) With --pack_dir, directory where each song's output "
+                                             "simfile and #OFFSET/#BPMS text file will be written, "
+                                             "in a folder named after the song")
+    parser.add_argument("--overwrite_input_simfiles", help="(OPTIONAL) With --pack_dir, overwrite the #OFFSET and "
+                                                           "#BPMS fields of each song's simfile in place, "
+                                                           "without asking",
+                        action="store_true")
+    parser.add_argument("--workers", help="(OPTIONAL) Number of worker processes.  Default is the number of CPUs",
+                        type=int)
+    parser.add_argument("--stream_audio", help="(OPTIONAL) Stream each song's audio into the beat tracker block by "
+                                               "block instead of loading the whole file into memory",
+                        action="store_true")
+    parser.add_argument("--max_bpm_drift_ms", help="(OPTIONAL) Merge each song's detected BPMs into fewer #BPMS "
+                                                   "entries (greedily, so not always the fewest possible), such that "
+                                                   "no beat drifts from its detected time by more than this many "
+                                                   "milliseconds",
+                        type=float)
+    parser.add_argument("--full_simfile_rewrite", help="(OPTIONAL) Parse and re-serialize each whole simfile with "
+                                                       "the simfile library, instead of only rewriting its #OFFSET "
+                                                       "and #BPMS tags",
+                        action="store_true")
+    parser.add_argument("--tempo_prepass", help="(OPTIONAL) Skip the beat tracker for songs whose tempo a quick "
+                                                "constant tempo estimate finds steady enough",
+                        action="store_true")
+    parser.add_argument("--tempo_prepass_min_confidence", help="(OPTIONAL) Confidence of the estimated tempo, "
+                                                               "from 0 (chance) to 1, needed to skip the beat "
+                                                               "tracker",
+                        type=float)
+    parser.add_argument("--tempo_prepass_unstable_regions_only", help="(OPTIONAL) For the other songs, only run the "
+                                                                      "beat tracker where the tempo isn't steady",
+                        action="store_true")
+    parser.add_argument("--no_cache", help="(OPTIONAL) Don't read or write the on-disk cache of detected beats",
+                        action="store_true")
+    parser.add_argument("--refresh_cache", help="(OPTIONAL) Run the beat tracker again for every song and update "
+                                                "the cache",
+                        action="store_true")
+    parser.add_argument("--cache_dir", help="(OPTIONAL) Directory of the cache of detected beats")
+    parser.add_argument("--summary_path", help="(OPTIONAL) Path to the JSON summary report of every job.  Default is "
+                                               "{} in the output directory (or the pack directory)"
+                                               "".format(DEFAULT_SUMMARY_FILENAME))
+    args = parser.parse_args()
+
+    if args.pack_dir is not None:
+        if args.output_dir is None and not args.overwrite_input_simfiles:
+            parser.error("With --pack_dir you must specify --output_dir or --overwrite_input_simfiles, "
+                         "or the outputs won't be saved anywhere")
+        jobs = find_pack_jobs(args.pack_dir, output_dir=args.output_dir,
+                              overwrite_input_simfiles=args.overwrite_input_simfiles)
+        default_summary_dir = pathlib.Path(args.output_dir if args.output_dir is not None else args.pack_dir)
+    else:
+        jobs = load_manifest_jobs(args.manifest_path)
+        default_summary_dir = pathlib.Path(args.manifest_path).parent
+    for job in jobs:
+        job["kwargs"].update(use_cache=not args.no_cache, refresh_cache=args.refresh_cache, cache_dir=args.cache_dir,
+                             stream_audio=args.stream_audio, max_bpm_drift_ms=args.max_bpm_drift_ms,
+                             full_simfile_rewrite=args.full_simfile_rewrite, tempo_prepass=args.tempo_prepass,
+                             tempo_prepass_min_confidence=args.tempo_prepass_min_confidence,
+                             tempo_prepass_unstable_regions_only=args.tempo_prepass_unstable_regions_only)
+
+    if args.summary_path is not None:
+        summary_path = pathlib.Path(args.summary_path)
+    else:
+        default_summary_dir.mkdir(parents=True, exist_ok=True)
+        summary_path = default_summary_dir / DEFAULT_SUMMARY_FILENAME
+
+    print("Running {} jobs".format(len(jobs)))
+    run_batch(jobs, workers=args.workers, summary_path=summary_path)
+
+
+if __name__ == "__main__":
+    main()
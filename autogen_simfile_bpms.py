@@ -1,16 +1,32 @@
-import csv
-import vamp
-import soundfile as sf
+# vamp, soundfile and simfile are imported where they are used rather than here, since loading the Vamp host
+# and libsndfile dominates the startup time of the beats CSV workflow, which never touches audio
 import argparse
+import hashlib
+import json
+import math
+import os
 import pathlib
+import re
 import sys
+import tempfile
+import time
 import numpy as np
-from warnings import warn
-from typing import List
-import simfile
+from warnings import catch_warnings, filterwarnings, warn
+from typing import Callable, List, Optional
+from collections.abc import MutableSequence
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS won't be reported there
+    resource = None
 
 
 class SingleBeatTimestampData(object):
+    """
+    A single beat.  BeatsTimestampData stores its beats as arrays, and BeatsTimestampData.beats returns copies
+    of them as SingleBeatTimestampData, so changing the timestamp or label of a returned beat doesn't change the
+    arrays: assign it back with beats[i] = beat.
+    """
     def __init__(self, timestamp: float = None, label: str = None):
         self.timestamp = timestamp
         self.label = label
@@ -28,16 +44,187 @@ class SingleBeatTimestampData(object):
             raise ValueError("Invalid beat label {}, should be '1', '2', '3', '4'".format(label))
 
 
+class _BeatsView(MutableSequence):
+    """
+    The list-like beats of a BeatsTimestampData.  Indexing returns copies of the beats, and setting, deleting,
+    inserting or appending SingleBeatTimestampData objects writes their values to the arrays.  Searching
+    (in, index, count, remove) compares beats by timestamp and label.
+    """
+    def __init__(self, beats_data: 'BeatsTimestampData'):
+        self._beats_data = beats_data
+
+    def __len__(self):
+        return len(self._beats_data.timestamps)
+
+    def _check_index(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Beat index {} out of range".format(index))
+        return index
+
+    def _beat(self, index: int) -> SingleBeatTimestampData:
+        return SingleBeatTimestampData(float(self._beats_data.timestamps[index]), str(self._beats_data.labels[index]))
+
+    def _matches(self, beat: SingleBeatTimestampData) -> np.ndarray:
+        label = beat.label if beat.label is not None else ''
+        return (self._beats_data.timestamps == beat.timestamp) & (self._beats_data.labels == label)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._beat(i) for i in range(*index.indices(len(self)))]
+        return self._beat(self._check_index(index))
+
+    def __setitem__(self, index, beat):
+        beats_data = self._beats_data
+        if isinstance(index, slice):
+            beats = list(self)
+            beats[index] = [SingleBeatTimestampData(new_beat.timestamp, new_beat.label) for new_beat in beat]
+            beats_data.set_data(beats)
+            return
+        index = self._check_index(index)
+        timestamp, label = float(beat.timestamp), beat.label if beat.label is not None else ''
+        timestamps, labels = beats_data.timestamps, beats_data.labels
+        if not timestamps.flags.writeable:  # Memory-mapped from a file; copy on the first write
+            timestamps = timestamps.copy()
+        if len(label) > labels.dtype.itemsize // np.dtype('<U1').itemsize:  # Widen the string dtype if needed
+            labels = labels.astype('<U{}'.format(len(label)))
+        elif not labels.flags.writeable:
+            labels = labels.copy()
+        timestamps[index], labels[index] = timestamp, label
+        beats_data.timestamps, beats_data.labels = timestamps, labels
+
+    def __delitem__(self, index):
+        indices = range(*index.indices(len(self))) if isinstance(index, slice) else self._check_index(index)
+        beats_data = self._beats_data
+        beats_data.set_columns(np.delete(beats_data.timestamps, indices), np.delete(beats_data.labels, indices))
+
+    def insert(self, index: int, beat: SingleBeatTimestampData):
+        index = min(max(index + len(self) if index < 0 else index, 0), len(self))  # Clamped like list.insert
+        beats_data = self._beats_data
+        timestamps, labels = beats_data.timestamps, beats_data.labels
+        # Concatenating widens the label dtype if the new label is longer than the others
+        beats_data.set_columns(
+            np.concatenate((timestamps[:index], [float(beat.timestamp)], timestamps[index:])),
+            np.concatenate((labels[:index], np.array([beat.label if beat.label is not None else ''], dtype=str),
+                            labels[index:])))
+
+    def reverse(self):
+        self._beats_data.set_columns(self._beats_data.timestamps[::-1].copy(), self._beats_data.labels[::-1].copy())
+
+    def __contains__(self, beat) -> bool:
+        return bool(np.any(self._matches(beat)))
+
+    def index(self, beat, start: int = 0, stop: int = None) -> int:
+        start, stop, _ = slice(start, stop).indices(len(self))
+        matches = np.flatnonzero(self._matches(beat)[start:stop])
+        if len(matches) == 0:
+            raise ValueError("Beat at {} with label '{}' is not in the beats".format(beat.timestamp, beat.label))
+        return start + int(matches[0])
+
+    def count(self, beat) -> int:
+        return int(np.count_nonzero(self._matches(beat)))
+
+
 class BeatsTimestampData(object):
+    """
+    Beat timestamps and labels, stored as columns: timestamps is a float64 array (in seconds or samples,
+    according to timestamp_type) and labels is a string array of the same length.  The beats attribute gives
+    the old per-beat SingleBeatTimestampData interface as a list-like wrapper of these arrays.
+    """
     VALID_TIMESTAMP_TYPES = ['samples', 'seconds']
     TIMESTAMP_UNSET_TYPE = 'unset'
 
-    def __init__(self, data: List[SingleBeatTimestampData] = None, timestamp_type: str = None):
-        self.beats = data if data is not None else []
+    def __init__(self, data: List[SingleBeatTimestampData] = None, timestamp_type: str = None,
+                 timestamps: np.ndarray = None, labels: np.ndarray = None):
+        self.timestamps = np.empty(0, dtype=np.float64)
+        self.labels = np.empty(0, dtype=str)
+        if data is not None:
+            self.set_data(data)
+        elif timestamps is not None:
+            self.set_columns(timestamps, labels)
         self.timestamp_type = timestamp_type if timestamp_type is not None else self.TIMESTAMP_UNSET_TYPE
 
+    @classmethod
+    def from_vamp_features(cls, features: List[dict], timestamp_type: str):
+        timestamps = np.fromiter((float(feature['timestamp']) for feature in features), dtype=np.float64,
+                                 count=len(features))
+        labels = np.array([feature.get('label', '') for feature in features], dtype=str)
+        return cls(timestamps=timestamps, labels=labels, timestamp_type=timestamp_type)
+
+    @classmethod
+    def from_plugin_features(cls, features: List[dict], beats_per_bar: int):
+        """
+        Like from_vamp_features, but for the output of any beat detector: the beats are sorted and deduplicated,
+        and labels that aren't bar positions (1 to beats_per_bar, as the bar and beat tracker gives them) are
+        cleared, since other plugins label their beats with tempos or nothing at all.
+        """
+        beats = cls.from_vamp_features(features, 'seconds')
+        order = np.argsort(beats.timestamps, kind='stable')
+        timestamps, labels = beats.timestamps[order], beats.labels[order]
+        keep = np.concatenate(([True], np.diff(timestamps) > 0))[:len(timestamps)]
+        timestamps, labels = timestamps[keep], labels[keep]
+        try:
+            positions = labels.astype(np.int64)
+            is_bar_positions = bool(np.all((positions >= 1) & (positions <= beats_per_bar)))
+        except ValueError:
+            is_bar_positions = False
+        if not is_bar_positions:
+            labels = np.full(len(timestamps), '', dtype=str)
+        return cls(timestamps=timestamps, labels=labels, timestamp_type='seconds')
+
+    @classmethod
+    def from_records(cls, records: np.ndarray):
+        """
+        The inverse of to_records.  The seconds timestamps and the labels are views of the records, so beats saved
+        with to_records and memory-mapped back with np.load(path, mmap_mode='r') are loaded without parsing or
+        copying.
+        """
+        field_names = records.dtype.names or ()
+        timestamp_types = [timestamp_type for timestamp_type in cls.VALID_TIMESTAMP_TYPES
+                           if timestamp_type in field_names]
+        if len(timestamp_types) != 1:
+            raise ValueError("Beats array must have one of the fields '{}', got fields {}".format(
+                "', '".join(cls.VALID_TIMESTAMP_TYPES), field_names))
+        return cls(timestamps=records[timestamp_types[0]], labels=records['label'] if 'label' in field_names else None,
+                   timestamp_type=timestamp_types[0])
+
+    def to_records(self) -> np.ndarray:
+        """
+        :return: the beats as a structured array, with a 'seconds' (float64) or 'samples' (int64) timestamp field
+                 named after the timestamp type, and a 'label' field
+        """
+        if self.timestamp_type not in self.VALID_TIMESTAMP_TYPES:
+            raise ValueError("Cannot save beats with timestamp_type {}".format(self.timestamp_type))
+        timestamp_dtype = np.int64 if self.timestamp_type == 'samples' else np.float64
+        records = np.empty(len(self), dtype=[(self.timestamp_type, timestamp_dtype), ('label', self.labels.dtype)])
+        records[self.timestamp_type] = self.timestamps
+        records['label'] = self.labels
+        return records
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def beats(self) -> MutableSequence:
+        return _BeatsView(self)
+
+    @beats.setter
+    def beats(self, data: List[SingleBeatTimestampData]):
+        self.set_data(data)
+
     def set_data(self, data: List[SingleBeatTimestampData]):
-        self.beats = data
+        self.set_columns([float(beat.timestamp) for beat in data],
+                         [beat.label if beat.label is not None else '' for beat in data])
+
+    def set_columns(self, timestamps: np.ndarray, labels: np.ndarray = None):
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        labels = np.asarray(labels, dtype=str) if labels is not None else np.full(len(timestamps), '', dtype=str)
+        if timestamps.shape != labels.shape or timestamps.ndim != 1:
+            raise ValueError("Timestamps and labels must be 1-D arrays of the same length, "
+                             "got shapes {} and {}".format(timestamps.shape, labels.shape))
+        self.timestamps = timestamps
+        self.labels = labels
 
     def set_timestamp_type(self, timestamp_type: str):
         if timestamp_type in self.VALID_TIMESTAMP_TYPES:
@@ -51,29 +238,692 @@ class BeatsTimestampData(object):
 
 
 class BPMsData(object):
-    def __init__(self, bpms: List[float] = None, beat_markers: List[int] = None):
-        self.bpms = bpms if bpms is not None else []
-        self.beat_markers = beat_markers if beat_markers is not None else []
+    """
+    BPM segments, stored as columns: bpms is a float64 array and beat_markers is an int64 array of the same
+    length.  Add segments one at a time with append, or set whole columns with set_bpms and set_beat_markers.
+    """
+    def __init__(self, bpms: np.ndarray = None, beat_markers: np.ndarray = None):
+        self.bpms = np.asarray(bpms if bpms is not None else [], dtype=np.float64)
+        self.beat_markers = np.asarray(beat_markers if beat_markers is not None else [], dtype=np.int64)
 
-    def set_bpms(self, bpms: List[float]):
-        self.bpms = bpms
+    def append(self, beat_marker: int, bpm: float):
+        self.beat_markers = np.append(self.beat_markers, np.int64(beat_marker))
+        self.bpms = np.append(self.bpms, np.float64(bpm))
 
-    def set_beat_markers(self, beat_markers: List[int]):
-        self.beat_markers = beat_markers
+    def set_bpms(self, bpms: np.ndarray):
+        self.bpms = np.asarray(bpms, dtype=np.float64)
+
+    def set_beat_markers(self, beat_markers: np.ndarray):
+        self.beat_markers = np.asarray(beat_markers, dtype=np.int64)
+
+    def to_records(self) -> np.ndarray:
+        """
+        :return: the BPM segments as a structured array with 'beat_marker' (int64) and 'bpm' (float64) fields
+        """
+        records = np.empty(len(self.bpms), dtype=[('beat_marker', np.int64), ('bpm', np.float64)])
+        records['beat_marker'] = self.beat_markers
+        records['bpm'] = self.bpms
+        return records
+
+
+class BeatTimestampCache(object):
+    """
+    On-disk cache of beat tracker output, one .npy file of BeatsTimestampData.to_records per entry, which is
+    memory-mapped when loaded.  Entries are keyed by a hash of the
+    audio, the plugin identifier, the plugin parameters and the sampling rate, and the least recently used
+    entries are evicted once the cache grows past max_size_bytes.
+    """
+    CACHE_VERSION = 2
+    DEFAULT_CACHE_DIR = pathlib.Path.home() / ".cache" / "autogen_simfile_bpms"
+    DEFAULT_MAX_SIZE_BYTES = 256 * 1024 ** 2
+    HASH_CHUNK_BYTES = 1024 ** 2
+
+    def __init__(self, cache_dir=None, max_size_bytes: int = None):
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir is not None else self.DEFAULT_CACHE_DIR
+        self.max_size_bytes = max_size_bytes if max_size_bytes is not None else self.DEFAULT_MAX_SIZE_BYTES
+
+    @classmethod
+    def hash_audio_file(cls, audio_path) -> str:
+        file_hash = hashlib.sha256()
+        with open(audio_path, "rb") as infile:
+            for chunk in iter(lambda: infile.read(cls.HASH_CHUNK_BYTES), b""):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    @staticmethod
+    def hash_audio_array(audio: np.ndarray) -> str:
+        audio = np.ascontiguousarray(audio)
+        array_hash = hashlib.sha256("{}{}".format(audio.dtype.str, audio.shape).encode())
+        array_hash.update(memoryview(audio).cast("B"))
+        return array_hash.hexdigest()
+
+    def make_key(self, audio_hash: str, plugin_identifier: str, plugin_parameters: dict, sampling_rate,
+                 beat_tracking_windows: dict = None) -> str:
+        key_fields = {"version": self.CACHE_VERSION, "audio": audio_hash, "plugin": plugin_identifier,
+                      "parameters": plugin_parameters, "sampling_rate": sampling_rate}
+        if beat_tracking_windows is not None:
+            # Stitched beats differ a little from a single pass, so they are kept apart
+            key_fields["windows"] = beat_tracking_windows
+        return hashlib.sha256(json.dumps(key_fields, sort_keys=True).encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> pathlib.Path:
+        return self.cache_dir / "{}.npy".format(key)
+
+    def load(self, key: str) -> Optional[BeatsTimestampData]:
+        entry_path = self._entry_path(key)
+        try:
+            beats_timestamp_data = BeatsTimestampData.from_records(np.load(entry_path, mmap_mode='r'))
+            os.utime(entry_path)  # Mark as recently used
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        return beats_timestamp_data
+
+    def store(self, key: str, beats_timestamp_data: BeatsTimestampData):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file and rename, so that concurrent readers never see a partial entry
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".npy.tmp", delete=False) as outfile:
+            np.save(outfile, beats_timestamp_data.to_records())
+        os.replace(outfile.name, self._entry_path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry_path in self.cache_dir.glob("*.np[yz]"):  # .npz entries are from cache version 1
+            try:
+                entry_stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_path))
+        total_size = sum(entry[1] for entry in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            try:
+                entry_path.unlink()
+            except OSError:  # Already evicted by another process, or still mapped on Windows
+                pass
+            total_size -= size
+
+
+class PolyphaseResampler(object):
+    """
+    Resample by a rational factor with a polyphase Kaiser-windowed sinc FIR filter.  The filter is symmetric
+    and centered, so there is no delay: output sample n is at the same time (n / target_rate seconds) as the
+    input at n / target_rate * orig_rate.  Feed the signal through process() in blocks of any size and call
+    flush() at the end; the concatenated outputs are the whole resampled signal, of length
+    ceil(input_length * target_rate / orig_rate).
+    """
+    ZERO_CROSSINGS = 16  # Half length of the filter, in zero crossings of the lower of the two Nyquist rates
+    ROLLOFF = 0.94  # Cutoff as a fraction of the lower Nyquist rate, to leave room for the transition band
+    KAISER_BETA = 8.6
+    OUTPUT_CHUNK_SIZE = 16384  # Output samples computed at a time, to bound the memory of the windowed views
+
+    def __init__(self, orig_sampling_rate: int, target_sampling_rate: int, zero_crossings: int = None):
+        zero_crossings = zero_crossings if zero_crossings is not None else self.ZERO_CROSSINGS
+        divisor = math.gcd(int(orig_sampling_rate), int(target_sampling_rate))
+        self.up = int(target_sampling_rate) // divisor
+        self.down = int(orig_sampling_rate) // divisor
+        # Prototype low-pass filter at the upsampled rate, with gain `up` to make up for the inserted zeros
+        cutoff = self.ROLLOFF / (2 * max(self.up, self.down))  # In cycles per upsampled sample
+        filter_half_length = zero_crossings * max(self.up, self.down)
+        self.half_taps = filter_half_length // self.up + 1
+        # Filter bank: phase p, tap m is the prototype at offset p + (m - half_taps) * up, reversed along m so
+        # that each row lines up with an ascending window of input samples
+        offsets = np.arange(self.up)[:, np.newaxis] + \
+            (np.arange(2 * self.half_taps + 1)[np.newaxis, :] - self.half_taps) * self.up
+        window = np.kaiser(2 * filter_half_length + 1, self.KAISER_BETA)[np.clip(offsets + filter_half_length, 0,
+                                                                                  2 * filter_half_length)]
+        bank = 2 * cutoff * np.sinc(2 * cutoff * offsets) * window * self.up
+        bank[np.abs(offsets) > filter_half_length] = 0.
+        self.filter_bank = bank[:, ::-1].astype(np.float32)
+        # Input samples from global index self._buffer_start onwards; starts with zeros before the signal
+        self._buffer = np.zeros(self.half_taps, dtype=np.float32)
+        self._buffer_start = -self.half_taps
+        self._num_input = 0
+        self._next_output = 0
+
+    def _produce(self, last_output: int) -> np.ndarray:
+        # Compute outputs self._next_output .. last_output (inclusive), all of whose inputs are in the buffer
+        if last_output < self._next_output:
+            return np.empty(0, dtype=np.float32)
+        outputs = []
+        windows = np.lib.stride_tricks.sliding_window_view(self._buffer, 2 * self.half_taps + 1)
+        for chunk_start in range(self._next_output, last_output + 1, self.OUTPUT_CHUNK_SIZE):
+            output_indices = np.arange(chunk_start, min(chunk_start + self.OUTPUT_CHUNK_SIZE, last_output + 1))
+            upsampled_indices = output_indices * self.down
+            centers = upsampled_indices // self.up
+            phases = upsampled_indices % self.up
+            chunk_windows = windows[centers - self.half_taps - self._buffer_start]
+            outputs.append(np.einsum('ij,ij->i', chunk_windows, self.filter_bank[phases]))
+        self._next_output = max(self._next_output, last_output + 1)
+        # Drop the input that no later output needs
+        needed_start = self._next_output * self.down // self.up - self.half_taps
+        if needed_start > self._buffer_start:
+            self._buffer = self._buffer[needed_start - self._buffer_start:]
+            self._buffer_start = needed_start
+        return np.concatenate(outputs) if outputs else np.empty(0, dtype=np.float32)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        self._buffer = np.concatenate((self._buffer, np.asarray(block, dtype=np.float32)))
+        self._num_input += len(block)
+        last_input = self._buffer_start + len(self._buffer) - 1
+        # Last output n whose window (n * down // up) + half_taps is within the buffered input
+        last_output = ((last_input - self.half_taps + 1) * self.up - 1) // self.down
+        return self._produce(last_output)
+
+    def flush(self) -> np.ndarray:
+        num_output = -(-self._num_input * self.up // self.down)
+        self._buffer = np.concatenate((self._buffer, np.zeros(2 * self.half_taps + 1, dtype=np.float32)))
+        return self._produce(num_output - 1)
+
+    def resample(self, signal: np.ndarray) -> np.ndarray:
+        return np.concatenate((self.process(signal), self.flush()))
+
+
+class ConstantTempoEstimator(object):
+    """
+    Cheap check of whether a song has one steady tempo, without the beat tracker.  The global tempo comes from
+    the autocorrelation of a spectral flux onset envelope of the downsampled audio, the phase from the envelope
+    summed along the beat grid, and both are then fitted by least squares to the strong onsets near the
+    predicted beats.  The confidence is the fraction of the predicted beats that land on a strong onset, over
+    the whole song and for each region of it, measured against the fraction that grids shifted off the beat
+    land on by chance: 1 when every beat lands on an onset, 0 when the beats do no better than chance (as in
+    noise, where onsets are everywhere).  Regions without any strong onset don't count.
+    """
+    ANALYSIS_SAMPLING_RATE = 11025
+    RESAMPLER_ZERO_CROSSINGS = 4  # A short filter is plenty for onsets, and resampling is most of the cost
+    FRAME_SIZE = 256  # Samples per spectrum of the onset envelope
+    HOP_SIZE = 64  # Samples between spectra, about 6 ms at the analysis rate
+    FRAMES_PER_CHUNK = 4096  # Spectra computed at a time, to bound memory
+    LOCAL_MEAN_SEC = 0.5  # The onset envelope is taken relative to its moving average over this span
+    ONSET_LATENCY_SEC = 0.005  # Added to the onset peak times to line them up with the onsets (measured on clicks)
+    MIN_BPM = 60.
+    MAX_BPM = 240.
+    PRIOR_BPM = 120.  # Center of the log-normal tempo prior that settles the octave of the tempo
+    PRIOR_OCTAVES = 1.
+    PERIOD_REFINEMENT_BEATS = 8  # The period is refined from the autocorrelation peak this many beats away
+    MATCH_TOLERANCE_SEC = 0.03  # A predicted beat lands on an onset if one is within this distance
+    STRONG_ONSET_RATIO = 0.3  # Strong onsets are at least this fraction of the typical beat onset strength
+    DOUBLE_TEMPO_RATIO = 0.85  # Double the tempo if the half beats have onsets nearly as often and as strong as this
+    REGION_SEC = 30.  # A shorter last region is merged into the one before it
+    CHANCE_PHASES = 16  # Number of grids shifted off the beat whose hit rate is the chance level
+
+    def __init__(self, audio: np.ndarray, sampling_rate: int):
+        audio = np.asarray(audio)  # Mono, or [channels, data] to downmix
+        audio = audio.mean(axis=0, dtype=np.float32) if audio.ndim > 1 else audio.astype(np.float32)
+        if sampling_rate != self.ANALYSIS_SAMPLING_RATE:
+            audio = PolyphaseResampler(sampling_rate, self.ANALYSIS_SAMPLING_RATE,
+                                       self.RESAMPLER_ZERO_CROSSINGS).resample(audio)
+        self.audio = audio
+        self.envelope_rate = self.ANALYSIS_SAMPLING_RATE / self.HOP_SIZE
+        self.duration_sec = len(audio) / self.ANALYSIS_SAMPLING_RATE
+
+    def onset_envelope(self) -> np.ndarray:
+        """
+        :return: the spectral flux (summed increase in log magnitude over the previous spectrum), relative to its
+                 local mean and half-wave rectified.  Value i is centered at i * HOP_SIZE analysis samples.
+        """
+        padding = np.zeros(self.FRAME_SIZE // 2, dtype=np.float32)
+        frames = np.lib.stride_tricks.sliding_window_view(np.concatenate((padding, self.audio, padding)),
+                                                          self.FRAME_SIZE)[::self.HOP_SIZE]
+        window = np.hanning(self.FRAME_SIZE).astype(np.float32)
+        flux = np.zeros(len(frames), dtype=np.float32)
+        previous_spectrum = None
+        for chunk_start in range(0, len(frames), self.FRAMES_PER_CHUNK):
+            spectra = np.log1p(100 * np.abs(np.fft.rfft(frames[chunk_start:chunk_start + self.FRAMES_PER_CHUNK]
+                                                        * window, axis=1)))
+            if previous_spectrum is None:
+                previous_spectrum = spectra[:1]
+            flux[chunk_start:chunk_start + len(spectra)] = \
+                np.maximum(np.diff(np.concatenate((previous_spectrum, spectra)), axis=0), 0.).sum(axis=1)
+            previous_spectrum = spectra[-1:]
+        local_mean_frames = max(1, min(int(round(self.LOCAL_MEAN_SEC * self.envelope_rate)), len(flux)))
+        local_mean = np.convolve(flux, np.full(local_mean_frames, 1. / local_mean_frames), mode='same')
+        return np.maximum(flux - local_mean, 0.)
+
+    @staticmethod
+    def _parabolic_peak_offsets(left: np.ndarray, center: np.ndarray, right: np.ndarray) -> np.ndarray:
+        # Offset of the vertex of the parabola through three equally spaced points, from the center one
+        denominators = left - 2 * center + right
+        with np.errstate(divide='ignore', invalid='ignore'):
+            offsets = np.where(denominators < 0, 0.5 * (left - right) / denominators, 0.)
+        return np.clip(offsets, -0.5, 0.5)
+
+    def _estimate_period(self, envelope: np.ndarray) -> Optional[float]:
+        """
+        :return: the beat period in envelope frames, or None if the song is too short to tell
+        """
+        num_frames = len(envelope)
+        min_lag = max(1, int(math.floor(60. * self.envelope_rate / self.MAX_BPM)))
+        max_lag = int(math.ceil(60. * self.envelope_rate / self.MIN_BPM))
+        if 2 * max_lag >= num_frames:
+            return None
+        centered = envelope - envelope.mean()
+        autocorrelation = np.fft.irfft(np.abs(np.fft.rfft(centered, 2 * num_frames)) ** 2)[:num_frames]
+        lags = np.arange(min_lag, max_lag + 1)
+        prior = np.exp(-0.5 * (np.log2(60. * self.envelope_rate / lags / self.PRIOR_BPM) / self.PRIOR_OCTAVES) ** 2)
+        best_lag = int(lags[np.argmax(autocorrelation[lags] * prior)])
+        period = best_lag + float(self._parabolic_peak_offsets(*autocorrelation[best_lag - 1:best_lag + 2]))
+        # The peak several beats away pins down the period several times more precisely
+        num_beats = self.PERIOD_REFINEMENT_BEATS
+        while num_beats > 1 and num_beats * period + num_beats + 2 >= num_frames:
+            num_beats //= 2
+        if num_beats > 1:
+            search_start = int(round(num_beats * period)) - num_beats
+            search = autocorrelation[search_start:search_start + 2 * num_beats + 1]
+            peak = int(np.clip(np.argmax(search), 1, len(search) - 2))
+            period = (search_start + peak + float(self._parabolic_peak_offsets(*search[peak - 1:peak + 2]))) \
+                / num_beats
+        return period
+
+    def _estimate_phase(self, envelope: np.ndarray, period: float) -> float:
+        """
+        :return: the time of the first beat in envelope frames, in [0, period)
+        """
+        phases = np.arange(int(math.ceil(period)))
+        beat_numbers = np.arange(int((len(envelope) - 1 - phases[-1]) // period) + 1)
+        indices = np.round(phases[:, np.newaxis] + period * beat_numbers[np.newaxis, :]).astype(np.int64)
+        return float(phases[np.argmax(envelope[np.minimum(indices, len(envelope) - 1)].sum(axis=1))])
+
+    def _strong_onsets(self, envelope: np.ndarray, num_beats: int) -> tuple:
+        """
+        :return: the times and strengths of the strong onsets
+        """
+        is_peak = (envelope[1:-1] > envelope[:-2]) & (envelope[1:-1] >= envelope[2:])
+        peaks = np.flatnonzero(is_peak) + 1
+        if len(peaks) == 0:
+            return np.empty(0), np.empty(0)
+        heights = envelope[peaks]
+        # Most of the strongest num_beats peaks of a song with a beat are the beats
+        typical_beat_height = np.median(np.sort(heights)[-max(1, num_beats):])
+        strong = heights >= self.STRONG_ONSET_RATIO * typical_beat_height
+        peaks, heights = peaks[strong], heights[strong]
+        offsets = self._parabolic_peak_offsets(envelope[peaks - 1], envelope[peaks], envelope[peaks + 1])
+        return (peaks + offsets) / self.envelope_rate + self.ONSET_LATENCY_SEC, heights
+
+    def _match_beats(self, onset_times: np.ndarray, first_beat_sec: float, period_sec: float) -> tuple:
+        """
+        :return: the predicted beat times of the grid, the index of the nearest strong onset to each, and whether
+                 that onset is within MATCH_TOLERANCE_SEC
+        """
+        beat_times = first_beat_sec + period_sec * np.arange(int(math.ceil((self.duration_sec - first_beat_sec)
+                                                                           / period_sec)))
+        nearest = np.clip(np.searchsorted(onset_times, beat_times), 1, len(onset_times) - 1)
+        nearest -= (beat_times - onset_times[nearest - 1]) < (onset_times[nearest] - beat_times)
+        return beat_times, nearest, np.abs(onset_times[nearest] - beat_times) <= self.MATCH_TOLERANCE_SEC
+
+    def _fit_grid(self, onset_times: np.ndarray, first_beat_sec: float, period_sec: float,
+                  tolerances_sec: List[float]) -> Optional[tuple]:
+        """
+        Fit the beat grid by least squares to the onsets it lands on, with each of the tolerances in turn
+
+        :return: the fitted first beat time (in the first beat period) and period, or None if it lands on no onsets
+        """
+        for tolerance_sec in tolerances_sec:
+            beat_times, nearest, _ = self._match_beats(onset_times, first_beat_sec, period_sec)
+            hits = np.abs(onset_times[nearest] - beat_times) <= tolerance_sec
+            if hits.sum() < 2:
+                return None
+            period_sec, first_beat_sec = np.polyfit(np.flatnonzero(hits), onset_times[nearest[hits]], 1)
+            first_beat_sec -= math.floor(first_beat_sec / period_sec) * period_sec
+        return first_beat_sec, period_sec
+
+    def estimate(self) -> dict:
+        """
+        :return: a dict with the tempo in BPM, the beat_times of the fitted beat grid (in seconds, starting at
+                 the first beat that lands on an onset), the confidence, and the region_confidences of each
+                 REGION_SEC region of the song (None for regions without strong onsets)
+        """
+        no_estimate = {"bpm": None, "beat_times": np.empty(0), "confidence": 0., "region_confidences": []}
+        envelope = self.onset_envelope()
+        period = self._estimate_period(envelope)
+        if period is None:
+            return no_estimate
+        period_sec = period / self.envelope_rate
+        first_beat_sec = self._estimate_phase(envelope, period) / self.envelope_rate + self.ONSET_LATENCY_SEC
+        onset_times, onset_heights = self._strong_onsets(envelope, int(self.duration_sec / period_sec))
+        if len(onset_times) < 2:
+            return no_estimate
+
+        # First allow for the error of the autocorrelation estimate, then tighten up
+        grid = self._fit_grid(onset_times, first_beat_sec, period_sec,
+                              [max(self.MATCH_TOLERANCE_SEC, 0.1 * period_sec)] + 2 * [self.MATCH_TOLERANCE_SEC])
+        if grid is None:
+            return no_estimate
+        first_beat_sec, period_sec = grid
+        beat_times, nearest, hits = self._match_beats(onset_times, first_beat_sec, period_sec)
+        # The autocorrelation can't tell a tempo from half of it when every other beat is accented, but then the
+        # half beats of the grid land on onsets about as strong as the beats
+        if 120. / period_sec <= self.MAX_BPM and hits.any():
+            _, half_beat_nearest, half_beat_hits = self._match_beats(onset_times, first_beat_sec + period_sec / 2,
+                                                                     period_sec)
+            if half_beat_hits.mean() >= self.DOUBLE_TEMPO_RATIO * hits.mean() and half_beat_hits.any() and \
+                    np.median(onset_heights[half_beat_nearest[half_beat_hits]]) >= \
+                    self.DOUBLE_TEMPO_RATIO * np.median(onset_heights[nearest[hits]]):
+                grid = self._fit_grid(onset_times, first_beat_sec, period_sec / 2, [self.MATCH_TOLERANCE_SEC])
+                if grid is not None:
+                    first_beat_sec, period_sec = grid
+                    beat_times, nearest, hits = self._match_beats(onset_times, first_beat_sec, period_sec)
+
+        # Don't count beats into the silence before the song starts
+        first_beat = int(np.argmax(hits)) if hits.any() else 0
+        beat_times, hits = beat_times[first_beat:], hits[first_beat:]
+        num_regions = self.num_regions()
+        region_beats, region_hits = self._region_hits(beat_times, hits, num_regions)
+        # Chance level: shift the grid by phases spread over the beat, clear of the beat and its tolerance
+        region_chance_beats = np.zeros(num_regions)
+        region_chance_hits = np.zeros(num_regions)
+        for shift_sec in np.linspace(2 * self.MATCH_TOLERANCE_SEC, period_sec - 2 * self.MATCH_TOLERANCE_SEC,
+                                     self.CHANCE_PHASES):
+            shifted_beats, shifted_regions_hits = self._region_hits(
+                *self._match_beats(onset_times, first_beat_sec + shift_sec, period_sec)[::2], num_regions)
+            region_chance_beats += shifted_beats
+            region_chance_hits += shifted_regions_hits
+        onset_regions = np.minimum((onset_times // self.REGION_SEC).astype(np.int64), num_regions - 1)
+        has_onsets = np.bincount(onset_regions, minlength=num_regions) > 0
+        region_confidences = [self._confidence(region_hits[region], region_beats[region],
+                                               region_chance_hits[region], region_chance_beats[region])
+                              if has_onsets[region] and region_beats[region] else None
+                              for region in range(num_regions)]
+        confidence = self._confidence(region_hits[has_onsets].sum(), region_beats[has_onsets].sum(),
+                                      region_chance_hits[has_onsets].sum(), region_chance_beats[has_onsets].sum()) \
+            if has_onsets.any() else 0.
+        return {"bpm": 60. / period_sec, "beat_times": beat_times, "confidence": confidence,
+                "region_confidences": region_confidences}
+
+    def num_regions(self) -> int:
+        return max(1, int(round(self.duration_sec / self.REGION_SEC)))
+
+    def _region_hits(self, beat_times: np.ndarray, hits: np.ndarray, num_regions: int) -> tuple:
+        """
+        :return: the number of beats in each region, and how many of them land on an onset
+        """
+        beat_regions = np.minimum((beat_times // self.REGION_SEC).astype(np.int64), num_regions - 1)
+        return np.bincount(beat_regions, minlength=num_regions), \
+            np.bincount(beat_regions, weights=hits, minlength=num_regions)
+
+    @staticmethod
+    def _confidence(num_hits: float, num_beats: float, num_chance_hits: float, num_chance_beats: float) -> float:
+        hit_rate = num_hits / num_beats if num_beats else 0.
+        chance_rate = num_chance_hits / num_chance_beats if num_chance_beats else 0.
+        if chance_rate >= 1.:
+            return 0.
+        return float(max(0., (hit_rate - chance_rate) / (1. - chance_rate)))
+
+
+# Significant tokens of the MSD format that .sm and .ssc files use: comments, escaped characters, and the
+# '#' and ';' that start and end a parameter.  Everything else (notably the note data) is skipped over.
+_MSD_TOKEN_PATTERN = re.compile(rb"//[^\r\n]*|\\[\s\S]|[#;]")
+SIMFILE_TIMING_TAGS = (b"OFFSET", b"BPMS")
+SIMFILE_CHART_TAGS = (b"NOTEDATA", b"NOTES")
+
+
+def scan_msd_parameters(data: bytes) -> List[tuple]:
+    """
+    Find the parameters (#NAME:value;) of an .sm or .ssc file without parsing their values, following the
+    rules of the simfile library's MSD parser: comments and escaped characters are skipped, and a '#' at the
+    start of a line inside a parameter ends the parameter if its ';' is missing.
+
+    :return: list of (name, start, value_start, value_end, end) tuples, where data[start:end] is the whole
+             parameter, data[value_start:value_end] its value (None if there is no ':'), and name is in uppercase
+    """
+    parameters = []
+    start = None
+    for match in _MSD_TOKEN_PATTERN.finditer(data):
+        token = match.group()
+        if token == b"#":
+            if start is None:
+                start = match.start()
+            elif match.start() > 0 and data[match.start() - 1] in b"\r\n":  # Recover from a missing ';'
+                parameters.append(_msd_parameter(data, start, match.start(), match.start()))
+                start = match.start()
+        elif token == b";" and start is not None:
+            parameters.append(_msd_parameter(data, start, match.start(), match.end()))
+            start = None
+    if start is not None:
+        parameters.append(_msd_parameter(data, start, len(data), len(data)))
+    return parameters
+
+
+def _msd_parameter(data: bytes, start: int, value_end: int, end: int) -> tuple:
+    colon = data.find(b":", start, value_end)
+    if colon == -1:
+        return data[start + 1:value_end].strip().upper(), start, None, value_end, end
+    return data[start + 1:colon].strip().upper(), start, colon + 1, value_end, end
+
+
+def patch_simfile_timing(data: bytes, offset: str, bpms: str) -> bytes:
+    """
+    Replace the values of every #OFFSET and #BPMS parameter in the simfile, including the per-chart timing
+    tags of .ssc files, leaving all other bytes (notably the note data) untouched.  If the song-level tags
+    are missing, they are inserted before the first chart.
+
+    :return: the patched simfile
+    """
+    newline = b"\r\n" if b"\r\n" in data[:4096] else b"\n"
+    new_values = {b"OFFSET": offset.encode(), b"BPMS": bpms.replace("\n", newline.decode()).encode()}
+    parameters = scan_msd_parameters(data)
+    first_chart_start = next((start for name, start, _, _, _ in parameters if name in SIMFILE_CHART_TAGS),
+                             len(data))
+    song_tags = {name for name, start, _, _, _ in parameters if start < first_chart_start}
+    # Edits are (start, end, replacement) byte ranges, applied in order.  A parameter missing its ';' gets one.
+    edits = [(value_start, value_end, new_values[name] + (b";" + newline if end == value_end else b""))
+             for name, _, value_start, value_end, end in parameters if name in new_values and value_start is not None]
+    missing_tags = b"".join(b"#" + tag + b":" + new_values[tag] + b";" + newline
+                            for tag in SIMFILE_TIMING_TAGS if tag not in song_tags)
+    if missing_tags and first_chart_start < len(data):
+        edits.append((first_chart_start, first_chart_start, missing_tags))
+    pieces = []
+    position = 0
+    for start, end, replacement in sorted(edits, key=lambda edit: edit[0]):
+        pieces.append(data[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(data[position:])
+    patched = b"".join(pieces)
+    if missing_tags and first_chart_start == len(data):  # No charts: append the missing tags at the end
+        if patched and not patched.endswith((b"\n", b"\r")):
+            patched += newline
+        patched += missing_tags
+    return patched
+
+
+def atomic_write_bytes(path, data: bytes, mode_source=None):
+    """
+    Write to a temporary file in the same directory and rename it over the path, so that the path always holds
+    either the old or the new contents, even if the process dies partway.  The new file gets the permissions of
+    the existing file (or of mode_source if the path doesn't exist yet).
+    """
+    path = pathlib.Path(path)
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix="." + path.name + ".", suffix=".tmp",
+                                     delete=False) as outfile:
+        try:
+            outfile.write(data)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        except BaseException:
+            outfile.close()
+            os.unlink(outfile.name)
+            raise
+    for existing_path in [path, mode_source]:
+        if existing_path is not None and pathlib.Path(existing_path).exists():
+            os.chmod(outfile.name, pathlib.Path(existing_path).stat().st_mode & 0o7777)
+            break
+    os.replace(outfile.name, path)
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024 ** 2 if sys.platform == "darwin" else peak_rss / 1024
+
+
+class PipelineMetrics(object):
+    """
+    Wall time, CPU time and peak RSS of each stage of one AudioBeatsToBPMs run, plus the audio duration,
+    beat count and BPM segment count.  Peak RSS is the peak of the whole process up to the end of the stage.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.audio_duration_sec = None
+        self.num_beats = None
+        self.num_bpms = None
+        self.extra = {}
+
+    @contextmanager
+    def stage(self, stage_name: str):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.stages[stage_name] = {"wall_sec": time.perf_counter() - start_wall,
+                                       "cpu_sec": time.process_time() - start_cpu,
+                                       "peak_rss_mb": peak_rss_mb()}
+
+    def to_dict(self) -> dict:
+        metrics = dict(self.extra)
+        metrics.update({"audio_duration_sec": self.audio_duration_sec, "num_beats": self.num_beats,
+                        "num_bpms": self.num_bpms, "stages": self.stages,
+                        "total_wall_sec": sum(stage["wall_sec"] for stage in self.stages.values()),
+                        "total_cpu_sec": sum(stage["cpu_sec"] for stage in self.stages.values()),
+                        "peak_rss_mb": peak_rss_mb()})
+        return metrics
+
+
+class MetricsAggregator(object):
+    """
+    Callable that sums up the metrics dicts of many runs, for use as an AudioBeatsToBPMs metrics callback
+    (or called directly on the metrics collected from other processes, as the batch runner does).
+    """
+    def __init__(self):
+        self.num_runs = 0
+        self.audio_duration_sec = 0.
+        self.num_beats = 0
+        self.num_bpms = 0
+        self.stages = {}
+        self.peak_rss_mb = None
+
+    def __call__(self, metrics: dict):
+        self.num_runs += 1
+        self.audio_duration_sec += metrics.get("audio_duration_sec") or 0.
+        self.num_beats += metrics.get("num_beats") or 0
+        self.num_bpms += metrics.get("num_bpms") or 0
+        for stage_name, stage in metrics.get("stages", {}).items():
+            totals = self.stages.setdefault(stage_name, {"count": 0, "wall_sec": 0., "cpu_sec": 0.})
+            totals["count"] += 1
+            totals["wall_sec"] += stage["wall_sec"]
+            totals["cpu_sec"] += stage["cpu_sec"]
+        if metrics.get("peak_rss_mb") is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb or 0., metrics["peak_rss_mb"])
+
+    def to_dict(self) -> dict:
+        return {"num_runs": self.num_runs, "audio_duration_sec": self.audio_duration_sec,
+                "num_beats": self.num_beats, "num_bpms": self.num_bpms, "stages": self.stages,
+                "max_peak_rss_mb": self.peak_rss_mb}
+
+
+def _track_beats_in_window(audio_window: np.ndarray, sampling_rate: int, plugin_identifier: str,
+                           plugin_parameters: dict) -> BeatsTimestampData:
+    # Runs in a worker process of the parallel beat tracking; the timestamps are relative to the window start
+    import vamp
+    plugin_key, plugin_output = split_plugin_identifier(plugin_identifier)
+    data = [x for x in vamp.process_audio(audio_window, sampling_rate, plugin_key, output=plugin_output,
+                                          parameters=plugin_parameters)]
+    return BeatsTimestampData.from_vamp_features(data, 'seconds')
+
+
+def _track_beats_in_shared_audio(audio_path: str, sampling_rate: int, plugin_identifier: str,
+                                 plugin_parameters: dict, beats_per_bar: int) -> BeatsTimestampData:
+    # Runs in a worker process of the multi-plugin beat tracking.  The audio is memory-mapped read-only from the
+    # file the parent wrote once, so all the workers share the same pages instead of each getting a copy.
+    import vamp
+    plugin_key, plugin_output = split_plugin_identifier(plugin_identifier)
+    audio = np.load(audio_path, mmap_mode='r')
+    data = [x for x in vamp.process_audio(audio, sampling_rate, plugin_key, output=plugin_output,
+                                          parameters=plugin_parameters)]
+    return BeatsTimestampData.from_plugin_features(data, beats_per_bar)
+
+
+def split_plugin_identifier(plugin_identifier: str) -> tuple:
+    """
+    Plugin identifiers may name the plugin output that gives the beats, as in
+    'qm-vamp-plugins:qm-tempotracker:beats'; without one, the plugin's first output is used.
+
+    :return: the Vamp plugin key and the output name ('' for the first output)
+    """
+    parts = plugin_identifier.split(":")
+    if len(parts) == 3:
+        return ":".join(parts[:2]), parts[2]
+    elif len(parts) == 2:
+        return plugin_identifier, ""
+    raise ValueError("Invalid plugin identifier '{}', must be 'library:plugin' or "
+                     "'library:plugin:output'".format(plugin_identifier))
+
+
+def consensus_beats(plugin_beats: List[BeatsTimestampData], tolerance_sec: float, min_votes: int = None) \
+        -> BeatsTimestampData:
+    """
+    The beats that at least min_votes of the beat detectors (by default a majority) place within tolerance_sec
+    of each other, each at the median of their times.  A beat's bar position label is taken from the first
+    detector that gives one.
+    """
+    if min_votes is None:
+        min_votes = len(plugin_beats) // 2 + 1
+    timestamps = np.concatenate([beats.timestamps for beats in plugin_beats])
+    labels = np.concatenate([beats.labels for beats in plugin_beats])
+    detectors = np.concatenate([np.full(len(beats), detector) for detector, beats in enumerate(plugin_beats)])
+    order = np.lexsort((detectors, timestamps))
+    timestamps, labels, detectors = timestamps[order], labels[order], detectors[order]
+
+    consensus_timestamps, consensus_labels = [], []
+    start = 0
+    while start < len(timestamps):
+        end = int(np.searchsorted(timestamps, timestamps[start] + tolerance_sec, side='right'))
+        # One vote per detector, from its earliest beat in the group
+        _, members = np.unique(detectors[start:end], return_index=True)
+        if len(members) >= min_votes:
+            members += start
+            consensus_timestamps.append(float(np.median(timestamps[members])))
+            member_labels = [label for label in labels[members] if label]
+            consensus_labels.append(member_labels[0] if member_labels else '')
+            start = end
+        else:
+            start += 1
+    return BeatsTimestampData(timestamps=consensus_timestamps, labels=consensus_labels, timestamp_type='seconds')
 
 
 class AudioBeatsToBPMs(object):
     SEC_DIFF_TOLERANCE = 1e-8
     MIN_FIRST_BEAT_SEC_FOR_WARN = 10.
     PLUGIN_IDENTIFIER = "qm-vamp-plugins:qm-barbeattracker"  # https://vamp-plugins.org/plugin-doc/qm-vamp-plugins.html
-    RUN_FROM_CANDIDATES = {"audio_input", "audio_path", "beats_path"}
+    RUN_FROM_CANDIDATES = {"audio_input", "audio_path", "beats_input", "beats_path"}
+    STREAM_FRAME_SIZE = 1024  # Samples per frame fed to the plugin when streaming the audio
+    STREAM_FRAMES_PER_READ = 64  # Frames decoded from the audio file at a time when streaming
+    DEFAULT_WINDOW_OVERLAP_SEC = 30.  # Overlap between neighbouring windows of the parallel beat tracking
+    MIN_WINDOW_SEC = 60.  # Shortest window the parallel beat tracking picks by itself
+    STITCH_TOLERANCE_SEC = 0.05  # Two windows agree on a beat if they place it within this distance
+    DEFAULT_BEATS_PER_BAR = 4  # The default of the plugin's "bpb" parameter
+    CONSENSUS_TOLERANCE_SEC = 0.07  # Beat detectors agree on a beat if they place it within this distance
+    BINARY_SUFFIX = ".npy"  # Beats and BPMs files with this suffix are NumPy structured arrays rather than CSV
+    DEFAULT_TEMPO_PREPASS_MIN_CONFIDENCE = 0.9  # Of the constant tempo estimate, overall and in every region
 
     def __init__(self, audio: np.ndarray = None, sampling_rate: int = None, input_audio_path=None,
                  input_beats_path=None, input_beats_sampling_rate=0,
                  input_simfile_path=None, output_simfile_path=None, output_txt_path=None,
-                 output_beat_markers_bpms_csv_path=None, overwrite_input_simfile=False,
-                 alternate_plugin_identifier=None):
+                 output_beat_markers_bpms_csv_path=None, output_beats_path=None, overwrite_input_simfile=False,
+                 alternate_plugin_identifier=None, plugin_parameters: dict = None, interactive=True,
+                 use_cache=True, refresh_cache=False, cache_dir=None, cache_max_size_mb: float = None,
+                 stream_audio=False, max_bpm_drift_ms: float = None, metrics_json_path=None,
+                 metrics_callbacks: List[Callable[[dict], None]] = None, beat_tracking_sampling_rate: int = None,
+                 full_simfile_rewrite=False, beat_tracking_workers: int = None,
+                 beat_tracking_window_sec: float = None, beat_tracking_window_overlap_sec: float = None,
+                 compare_plugin_identifiers: List[str] = None, compare_output_dir=None, tempo_prepass=False,
+                 tempo_prepass_min_confidence: float = None, tempo_prepass_unstable_regions_only=False,
+                 beats: BeatsTimestampData = None):
         self.audio = audio
+        self.input_beats = beats
         self.sampling_rate = sampling_rate
         self.input_audio_path = pathlib.Path(input_audio_path) if input_audio_path is not None else None
         self.input_beats_path = pathlib.Path(input_beats_path) if input_beats_path is not None else None
@@ -87,19 +937,50 @@ class AudioBeatsToBPMs(object):
         self.output_txt_path = pathlib.Path(output_txt_path) if output_txt_path is not None else None
         self.output_beat_markers_bpms_csv_path = pathlib.Path(output_beat_markers_bpms_csv_path) \
             if output_beat_markers_bpms_csv_path is not None else None
+        self.output_beats_path = pathlib.Path(output_beats_path) if output_beats_path is not None else None
         self.overwrite_input_simfile = overwrite_input_simfile
+        self.full_simfile_rewrite = full_simfile_rewrite
         self.plugin_identifier = alternate_plugin_identifier if alternate_plugin_identifier is not None else \
                                  self.PLUGIN_IDENTIFIER
+        self.plugin_parameters = plugin_parameters if plugin_parameters is not None else {}
+        self.compare_plugin_identifiers = list(compare_plugin_identifiers) \
+            if compare_plugin_identifiers is not None else []
+        self.compare_output_dir = pathlib.Path(compare_output_dir) if compare_output_dir is not None else None
+        self.plugin_beats = {}  # Beats of each plugin, when comparing plugins
+        self.beat_cache = BeatTimestampCache(cache_dir, int(cache_max_size_mb * 1024 ** 2)
+                                             if cache_max_size_mb is not None else None) if use_cache else None
+        self.refresh_cache = refresh_cache
+        self.beats_from_cache = False
+        self.stream_audio = stream_audio
+        self.beat_tracking_sampling_rate = beat_tracking_sampling_rate
+        self.beat_tracking_workers = beat_tracking_workers
+        self.beat_tracking_window_sec = beat_tracking_window_sec
+        self.beat_tracking_window_overlap_sec = beat_tracking_window_overlap_sec \
+            if beat_tracking_window_overlap_sec is not None else self.DEFAULT_WINDOW_OVERLAP_SEC
+        self.tempo_prepass = tempo_prepass
+        self.tempo_prepass_min_confidence = tempo_prepass_min_confidence \
+            if tempo_prepass_min_confidence is not None else self.DEFAULT_TEMPO_PREPASS_MIN_CONFIDENCE
+        self.tempo_prepass_unstable_regions_only = tempo_prepass_unstable_regions_only
+        self.tempo_prepass_report = None
+        self.tempo_beat_times = None  # Beat grid of the tempo pre-pass, kept between the unstable regions
+        self.unstable_tempo_regions_sec = None
+        self.beat_tracking_path = None  # How the beat timestamps were found, for the report
+        self.max_bpm_drift_ms = max_bpm_drift_ms
+        self.bpm_compaction_report = None
+        self.metrics = PipelineMetrics()
+        self.metrics_json_path = pathlib.Path(metrics_json_path) if metrics_json_path is not None else None
+        self.metrics_callbacks = list(metrics_callbacks) if metrics_callbacks is not None else []
+        self.interactive = interactive
         self.run_from = None
         self._verify_initialization_and_set_running_order()
 
-        self.beats_timestamp_data = BeatsTimestampData()
+        self.beats_timestamp_data = beats if beats is not None else BeatsTimestampData()
         self.bpms_data = BPMsData()
         self.offset = 0.
         self.simfile_bpms = None
 
     def _verify_initialization_and_set_running_order(self):
-        # Override order: Input beats path > input audio array > input audio path
+        # Override order: Input beats path > input beats > input audio array > input audio path
         if self.input_audio_path is not None:
             if not self.input_audio_path.is_file():
                 raise ValueError("{} is not a valid file path for the input audio".format(self.input_audio_path))
@@ -115,6 +996,11 @@ class AudioBeatsToBPMs(object):
                 warn("WARNING: Will not compute beat timestamps from the input audio, because you have specified "
                      "an existing file path {} from which the beat timestamps "
                      "will be extracted.".format(self.input_beats_path))
+        elif self.input_beats is not None:
+            self.run_from = "beats_input"
+            if self.audio is not None or self.input_audio_path is not None:
+                warn("WARNING: Will not compute beat timestamps from the input audio, because you have passed "
+                     "the beats in the initialization of this object.")
         else:  # No input CSV of beats
             if self.audio is not None and self.input_audio_path is not None:
                 self.run_from = "audio_input"
@@ -131,6 +1017,8 @@ class AudioBeatsToBPMs(object):
             elif self.output_simfile_path is not None and self.output_simfile_path != self.input_simfile_path:
                 raise ValueError("Ambiguous input: cannot specify both --overwrite_input_simfile and "
                                  "--output_simfile_path, unless the input simfile path is the same as the output")
+            elif not self.interactive:
+                self.output_simfile_path = self.input_simfile_path
             else:
                 resolved = False
                 while not resolved:
@@ -147,7 +1035,7 @@ class AudioBeatsToBPMs(object):
             if self.output_simfile_path is not None:
                 if self.input_simfile_path is None:
                     raise ValueError("Cannot specify --output_simfile_path without --input_simfile_path")
-                elif self.output_simfile_path.exists():
+                elif self.output_simfile_path.exists() and self.interactive:
                     resolved = False
                     while not resolved:
                         user_response = input("WARNING: The output simfile path {} already exists.  "
@@ -159,11 +1047,100 @@ class AudioBeatsToBPMs(object):
                         elif user_response.lower() in ["n", "no"]:
                             print("Stopping program.")
                             sys.exit()
+        if self.beat_tracking_workers is not None and self.beat_tracking_workers < 1:
+            raise ValueError("Invalid number of beat tracking workers {}".format(self.beat_tracking_workers))
+        if self.beat_tracking_window_overlap_sec < 0:
+            raise ValueError("Invalid beat tracking window overlap {} s".format(self.beat_tracking_window_overlap_sec))
+        if self.beat_tracking_window_sec is not None and \
+                self.beat_tracking_window_sec <= self.beat_tracking_window_overlap_sec:
+            raise ValueError("The beat tracking window ({} s) must be longer than the overlap between windows "
+                             "({} s)".format(self.beat_tracking_window_sec, self.beat_tracking_window_overlap_sec))
+        if self.stream_audio and self.beat_tracking_workers is not None and self.beat_tracking_workers > 1:
+            warn("WARNING: Will not track the beats in parallel windows, because streamed audio is tracked "
+                 "in a single pass.")
+        if self.compare_plugin_identifiers:
+            if self.run_from in {"beats_path", "beats_input"}:
+                raise ValueError("Cannot compare beat detection plugins when the beats are given")
+            for plugin_identifier in self.compare_plugin_identifiers:
+                split_plugin_identifier(plugin_identifier)
+            if self.stream_audio or (self.beat_tracking_workers is not None and self.beat_tracking_workers > 1):
+                warn("WARNING: When comparing plugins, the audio is decoded once into memory and each plugin "
+                     "tracks the whole song in a single pass, ignoring --stream_audio and --beat_tracking_workers.")
+        elif self.compare_output_dir is not None:
+            raise ValueError("Cannot specify --compare_output_dir without --compare_plugin_identifiers")
+        if self.tempo_prepass:
+            if not 0 < self.tempo_prepass_min_confidence <= 1:
+                raise ValueError("Invalid tempo pre-pass minimum confidence {}, must be in (0, 1]"
+                                 "".format(self.tempo_prepass_min_confidence))
+            if self.run_from in {"beats_path", "beats_input"}:
+                warn("WARNING: Will not run the constant tempo pre-pass, because the beats are given.")
+            elif self.compare_plugin_identifiers:
+                warn("WARNING: Will not run the constant tempo pre-pass, because every compared plugin tracks "
+                     "the whole song.")
+            elif self.stream_audio:
+                warn("WARNING: Will not run the constant tempo pre-pass, because it needs the whole song in memory "
+                     "and the audio is streamed.")
+        elif self.tempo_prepass_unstable_regions_only:
+            raise ValueError("Cannot specify --tempo_prepass_unstable_regions_only without --tempo_prepass")
         if self.run_from not in self.RUN_FROM_CANDIDATES:
             raise ValueError("Invalid run configuration {}, must be one of the options "
                              "'{}'".format(self.run_from, "', '".join(self.RUN_FROM_CANDIDATES)))
 
+    def _stream_audio_frames(self):
+        import soundfile as sf
+        # Decode a block at a time, downmixing to mono float32 and resampling to the beat tracking sampling rate,
+        # and split the blocks into plugin frames.  The last frame is zero-padded to the full frame size.
+        resampler = PolyphaseResampler(self.sampling_rate, self.beat_tracking_sampling_rate) \
+            if self._resample_for_beat_tracking() else None
+        pending = np.empty(0, dtype=np.float32)
+        blocksize = self.STREAM_FRAME_SIZE * self.STREAM_FRAMES_PER_READ
+        for block in sf.blocks(str(self.input_audio_path), blocksize=blocksize, dtype='float32', always_2d=True):
+            mono = block.mean(axis=1, dtype=np.float32)
+            pending = np.concatenate((pending, resampler.process(mono) if resampler is not None else mono))
+            num_frames = len(pending) // self.STREAM_FRAME_SIZE
+            for start in range(0, num_frames * self.STREAM_FRAME_SIZE, self.STREAM_FRAME_SIZE):
+                yield pending[np.newaxis, start:start + self.STREAM_FRAME_SIZE]  # [channels, data]
+            pending = pending[num_frames * self.STREAM_FRAME_SIZE:]
+        if resampler is not None:
+            pending = np.concatenate((pending, resampler.flush()))
+        for start in range(0, len(pending), self.STREAM_FRAME_SIZE):
+            frame = np.zeros((1, self.STREAM_FRAME_SIZE), dtype=np.float32)
+            frame[0, :len(pending) - start] = pending[start:start + self.STREAM_FRAME_SIZE]
+            yield frame
+
+    def calculate_beat_timestamps_from_audio_stream(self, return_beats=False):
+        """
+        Same as calculate_beat_timestamps_from_vamp_plugin, but streams the audio from the input audio path
+        into the plugin block by block instead of loading the whole song, so memory use doesn't grow with
+        the length of the song.
+
+        :return:
+        """
+        import soundfile as sf
+        import vamp
+        if self.input_audio_path is None:
+            raise ValueError("No input audio path has been specified!")
+        elif not self.input_audio_path.is_file():
+            raise ValueError("Input audio path {} isn't a file".format(self.input_audio_path))
+        audio_info = sf.info(str(self.input_audio_path))
+        self.sampling_rate = audio_info.samplerate
+        self.metrics.audio_duration_sec = audio_info.duration
+        beat_tracking_sampling_rate = self.beat_tracking_sampling_rate if self._resample_for_beat_tracking() \
+            else self.sampling_rate
+        plugin_key, plugin_output = split_plugin_identifier(self.plugin_identifier)
+        data = [x for x in vamp.process_frames(self._stream_audio_frames(), beat_tracking_sampling_rate,
+                                               self.STREAM_FRAME_SIZE, plugin_key, output=plugin_output,
+                                               parameters=self.plugin_parameters)]
+        timestamp_type = 'seconds'
+        self.beats_timestamp_data = BeatsTimestampData.from_vamp_features(data, timestamp_type)
+        self.beat_tracking_path = "plugin"
+        print("Audio streamed from {}".format(self.input_audio_path))
+
+        if return_beats:
+            return self.beats_timestamp_data
+
     def load_audio_from_path(self, input_audio_path=None):
+        import soundfile as sf
         if input_audio_path is not None:
             self.input_audio_path = input_audio_path
         elif self.input_audio_path is None:
@@ -173,111 +1150,602 @@ class AudioBeatsToBPMs(object):
 
         self.audio, self.sampling_rate = sf.read(self.input_audio_path, always_2d=True)
         self.audio = self.audio.T  # [channels, data]
+        self.metrics.audio_duration_sec = self.audio.shape[1] / self.sampling_rate
         print("Audio loaded from {}".format(self.input_audio_path))
 
+    def _resample_for_beat_tracking(self) -> bool:
+        return bool(self.beat_tracking_sampling_rate) and self.beat_tracking_sampling_rate != self.sampling_rate
+
+    def preprocess_audio_for_beat_tracking(self):
+        """
+        Downmix the audio to mono float32 and, if a beat tracking sampling rate is set, resample it to that rate.
+        The beat tracker doesn't need the full bandwidth, and its work grows with the number of samples.
+        Resampling doesn't shift the audio in time, so the detected beat times in seconds are unaffected.
+
+        :return: the preprocessed [1, data] audio array and its sampling rate
+        """
+        if self.audio is None:
+            raise ValueError("No audio loaded!")
+        audio = np.asarray(self.audio)
+        mono = audio.mean(axis=0, dtype=np.float32) if audio.ndim > 1 else audio.astype(np.float32)
+        if not self._resample_for_beat_tracking():
+            return mono[np.newaxis, :], self.sampling_rate
+        resampled = PolyphaseResampler(self.sampling_rate, self.beat_tracking_sampling_rate).resample(mono)
+        return resampled[np.newaxis, :], self.beat_tracking_sampling_rate
+
     def calculate_beat_timestamps_from_vamp_plugin(self, return_beats=False):
         if self.audio is None:
             raise ValueError("No audio loaded!")
-        data = [x for x in vamp.process_audio(self.audio, self.sampling_rate, self.plugin_identifier)]
-        timestamp_type = 'seconds'
-        self.beats_timestamp_data = self._convert_beats_data_from_dicts_to_BeatsTimestampData(data, timestamp_type)
+        with self.metrics.stage("preprocess"):
+            audio, sampling_rate = self.preprocess_audio_for_beat_tracking()
+        with self.metrics.stage("beat_tracking"):
+            if self.unstable_tempo_regions_sec:
+                self.beats_timestamp_data = self.calculate_beat_timestamps_in_unstable_regions(
+                    audio, sampling_rate, self.tempo_beat_times, self.unstable_tempo_regions_sec)
+                self.beat_tracking_path = "tempo_prepass_and_plugin"
+            elif self.beat_tracking_workers is not None and self.beat_tracking_workers > 1:
+                self.beats_timestamp_data = self.calculate_beat_timestamps_in_windows(audio, sampling_rate)
+                self.beat_tracking_path = "plugin"
+            else:
+                import vamp
+                plugin_key, plugin_output = split_plugin_identifier(self.plugin_identifier)
+                data = [x for x in vamp.process_audio(audio, sampling_rate, plugin_key, output=plugin_output,
+                                                      parameters=self.plugin_parameters)]
+                timestamp_type = 'seconds'
+                self.beats_timestamp_data = BeatsTimestampData.from_vamp_features(data, timestamp_type)
+                self.beat_tracking_path = "plugin"
 
         if return_beats:
             return self.beats_timestamp_data
 
+    def calculate_beat_timestamps_from_tempo_prepass(self) -> bool:
+        """
+        Estimate a single tempo and offset for the whole song.  If the estimate is confident over the whole song
+        and in every region of it, its beat grid becomes the beat timestamps.  Otherwise, when only the unstable
+        regions are to be tracked, they are kept for calculate_beat_timestamps_from_vamp_plugin.
+
+        :return: whether the beat grid was taken as the beat timestamps
+        """
+        if self.audio is None:
+            raise ValueError("No audio loaded!")
+        duration_sec = np.asarray(self.audio).shape[-1] / self.sampling_rate
+        with self.metrics.stage("tempo_prepass"):
+            tempo_estimate = ConstantTempoEstimator(self.audio, self.sampling_rate).estimate()
+            unstable_regions_sec = self._unstable_tempo_regions(tempo_estimate, duration_sec)
+        accepted = tempo_estimate["confidence"] >= self.tempo_prepass_min_confidence and not unstable_regions_sec
+        beat_times = tempo_estimate["beat_times"]
+        self.tempo_prepass_report = {
+            "bpm": tempo_estimate["bpm"], "confidence": tempo_estimate["confidence"],
+            "region_confidences": tempo_estimate["region_confidences"],
+            "min_confidence": self.tempo_prepass_min_confidence,
+            "offset": -float(beat_times[0]) if len(beat_times) else None,
+            "unstable_regions_sec": unstable_regions_sec, "accepted": accepted}
+        if accepted:
+            self.beats_timestamp_data = BeatsTimestampData(timestamps=beat_times,
+                                                           labels=np.full(len(beat_times), '', dtype=str),
+                                                           timestamp_type='seconds')
+            self.beat_tracking_path = "tempo_prepass"
+        elif self.tempo_prepass_unstable_regions_only and unstable_regions_sec != [[0., duration_sec]]:
+            self.tempo_beat_times = beat_times
+            self.unstable_tempo_regions_sec = unstable_regions_sec
+        return accepted
+
+    def _beat_tracking_windows(self, num_samples: int, sampling_rate: int) -> List[tuple]:
+        """
+        Split the audio into windows that overlap by the window overlap.  Unless a window length is set,
+        the windows are sized to give each worker one window.
+
+        :return: the (start, end) sample indices of each window
+        """
+        overlap = int(round(self.beat_tracking_window_overlap_sec * sampling_rate))
+        if self.beat_tracking_window_sec is not None:
+            window = int(round(self.beat_tracking_window_sec * sampling_rate))
+        else:
+            window = max(int(math.ceil((num_samples - overlap) / self.beat_tracking_workers)) + overlap,
+                         int(round(max(self.MIN_WINDOW_SEC, 2 * self.beat_tracking_window_overlap_sec)
+                                   * sampling_rate)))
+        step = window - overlap
+        num_windows = max(1, int(math.ceil((num_samples - overlap) / step)))
+        return [(i * step, min(i * step + window, num_samples)) for i in range(num_windows)]
+
+    def calculate_beat_timestamps_in_windows(self, audio: np.ndarray, sampling_rate: int) -> BeatsTimestampData:
+        """
+        Track the beats of overlapping windows of the preprocessed [1, data] audio in a pool of
+        beat_tracking_workers processes, and stitch them together where neighbouring windows agree on a beat.
+
+        :return: the stitched beats, in seconds
+        """
+        windows = self._beat_tracking_windows(audio.shape[-1], sampling_rate)
+        self.metrics.extra["beat_tracking_windows"] = len(windows)
+        if len(windows) == 1:
+            return _track_beats_in_window(audio, sampling_rate, self.plugin_identifier, self.plugin_parameters)
+        window_beats = self._track_beats_in_windows(audio, windows, sampling_rate)
+        beats_per_bar = int(self.plugin_parameters.get("bpb", self.DEFAULT_BEATS_PER_BAR))
+        return self._stitch_window_beats(window_beats, [(start / sampling_rate, end / sampling_rate)
+                                                        for start, end in windows], beats_per_bar)
+
+    def _track_beats_in_windows(self, audio: np.ndarray, windows: List[tuple], sampling_rate: int) \
+            -> List[BeatsTimestampData]:
+        """
+        :return: the beats of each (start, end) window of the [1, data] audio, relative to the window start, tracked
+                 in a pool of beat_tracking_workers processes
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        workers = min(self.beat_tracking_workers or 1, len(windows))
+        if workers == 1:
+            return [_track_beats_in_window(audio[:, start:end], sampling_rate, self.plugin_identifier,
+                                           self.plugin_parameters) for start, end in windows]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_track_beats_in_window, audio[:, start:end], sampling_rate,
+                                       self.plugin_identifier, self.plugin_parameters) for start, end in windows]
+            return [future.result() for future in futures]
+
+    def _unstable_tempo_regions(self, tempo_estimate: dict, duration_sec: float) -> List[list]:
+        """
+        :return: the [start, end] seconds of each stretch of consecutive regions of the constant tempo estimate
+                 whose confidence is below the minimum confidence (the whole song if there is no estimate).
+                 Regions without onsets count as steady.
+        """
+        unstable_regions_sec = []
+        for region, region_confidence in enumerate(tempo_estimate["region_confidences"]):
+            if region_confidence is None or region_confidence >= self.tempo_prepass_min_confidence:
+                continue
+            start_sec = region * ConstantTempoEstimator.REGION_SEC
+            end_sec = duration_sec if region == len(tempo_estimate["region_confidences"]) - 1 else \
+                min(start_sec + ConstantTempoEstimator.REGION_SEC, duration_sec)
+            if start_sec >= end_sec:
+                continue
+            if unstable_regions_sec and unstable_regions_sec[-1][1] == start_sec:
+                unstable_regions_sec[-1][1] = end_sec
+            else:
+                unstable_regions_sec.append([start_sec, end_sec])
+        if tempo_estimate["bpm"] is None:
+            unstable_regions_sec = [[0., duration_sec]]
+        return unstable_regions_sec
+
+    def calculate_beat_timestamps_in_unstable_regions(self, audio: np.ndarray, sampling_rate: int,
+                                                      tempo_beat_times: np.ndarray,
+                                                      unstable_regions_sec: List[list]) -> BeatsTimestampData:
+        """
+        Track the beats of the unstable regions of the [1, data] audio with the plugin, keep the constant tempo grid
+        everywhere else, and stitch them together the same way as the parallel beat tracking windows.  Each
+        section is widened by up to half a region on either side, so that neighbouring sections overlap.
+
+        :return: the stitched beats, in seconds
+        """
+        duration_sec = audio.shape[-1] / sampling_rate
+        overlap_sec = min(self.beat_tracking_window_overlap_sec, ConstantTempoEstimator.REGION_SEC / 2)
+        section_bounds = sorted({0., duration_sec} | {bound for region in unstable_regions_sec for bound in region})
+        sections = [(start_sec, end_sec, [start_sec, end_sec] in unstable_regions_sec)
+                    for start_sec, end_sec in zip(section_bounds[:-1], section_bounds[1:])]
+        window_bounds_sec = [(max(0., start_sec - overlap_sec), min(duration_sec, end_sec + overlap_sec))
+                             for start_sec, end_sec, _ in sections]
+        plugin_windows = [(int(round(start_sec * sampling_rate)), int(round(end_sec * sampling_rate)))
+                          for (start_sec, end_sec), (_, _, unstable) in zip(window_bounds_sec, sections) if unstable]
+        self.metrics.extra["beat_tracking_windows"] = len(plugin_windows)
+        plugin_beats = iter(self._track_beats_in_windows(audio, plugin_windows, sampling_rate))
+        window_beats = []
+        for (start_sec, end_sec), (_, _, unstable) in zip(window_bounds_sec, sections):
+            if unstable:
+                window_beats.append(next(plugin_beats))
+            else:
+                grid_times = tempo_beat_times[(tempo_beat_times >= start_sec) & (tempo_beat_times < end_sec)]
+                window_beats.append(BeatsTimestampData(timestamps=grid_times - start_sec,
+                                                       labels=np.full(len(grid_times), '', dtype=str),
+                                                       timestamp_type='seconds'))
+        beats_per_bar = int(self.plugin_parameters.get("bpb", self.DEFAULT_BEATS_PER_BAR))
+        return self._stitch_window_beats(window_beats, window_bounds_sec, beats_per_bar)
+
+    @classmethod
+    def _stitch_window_beats(cls, window_beats: List[BeatsTimestampData], window_bounds_sec: List[tuple],
+                             beats_per_bar: int) -> BeatsTimestampData:
+        timestamps = window_beats[0].timestamps + window_bounds_sec[0][0]
+        labels = window_beats[0].labels
+        for beats, (window_start_sec, _), (_, previous_window_end_sec) in zip(window_beats[1:],
+                                                                              window_bounds_sec[1:],
+                                                                              window_bounds_sec[:-1]):
+            next_timestamps = beats.timestamps + window_start_sec
+            next_labels = beats.labels
+            seam = cls._find_window_seam(timestamps, next_timestamps, window_start_sec, previous_window_end_sec)
+            if seam is not None:
+                # Keep the earlier window up to the beat both windows agree on, and the later one after it
+                num_kept, next_start = seam[0] + 1, seam[1] + 1
+                next_reference, beats_after_previous = seam[1], 0
+            else:
+                warn("WARNING: The beats tracked in the windows on either side of {:.1f} s don't line up; "
+                     "there may be a glitch in the beats there.".format(window_start_sec))
+                overlap_middle_sec = (window_start_sec + previous_window_end_sec) / 2
+                num_kept = int(np.searchsorted(timestamps, overlap_middle_sec))
+                next_start = int(np.searchsorted(next_timestamps, overlap_middle_sec))
+                next_reference, beats_after_previous = next_start, 1
+            if num_kept > 0 and next_reference < len(next_labels):
+                next_labels = cls._align_bar_labels(next_labels, next_labels[next_reference],
+                                                    labels[num_kept - 1], beats_after_previous, beats_per_bar)
+            timestamps = np.concatenate((timestamps[:num_kept], next_timestamps[next_start:]))
+            labels = np.concatenate((labels[:num_kept], next_labels[next_start:]))
+        return BeatsTimestampData(timestamps=timestamps, labels=labels, timestamp_type='seconds')
+
+    @classmethod
+    def _find_window_seam(cls, timestamps: np.ndarray, next_timestamps: np.ndarray, overlap_start_sec: float,
+                          overlap_end_sec: float) -> Optional[tuple]:
+        """
+        Find the beat that both windows place within STITCH_TOLERANCE_SEC of each other, closest to the middle
+        of their overlap, where both are furthest from the window edges that the beat tracker is least sure of.
+
+        :return: the beat's index in timestamps and in next_timestamps, or None if the windows agree on no beat
+        """
+        candidates = np.flatnonzero((next_timestamps >= overlap_start_sec) & (next_timestamps <= overlap_end_sec))
+        if len(candidates) == 0 or len(timestamps) < 2:
+            return None
+        candidate_secs = next_timestamps[candidates]
+        nearest = np.clip(np.searchsorted(timestamps, candidate_secs), 1, len(timestamps) - 1)
+        nearest -= (candidate_secs - timestamps[nearest - 1]) < (timestamps[nearest] - candidate_secs)
+        matched = np.abs(timestamps[nearest] - candidate_secs) <= cls.STITCH_TOLERANCE_SEC
+        if not matched.any():
+            return None
+        overlap_middle_sec = (overlap_start_sec + overlap_end_sec) / 2
+        best = int(np.argmin(np.where(matched, np.abs(candidate_secs - overlap_middle_sec), np.inf)))
+        return int(nearest[best]), int(candidates[best])
+
+    @staticmethod
+    def _align_bar_labels(labels: np.ndarray, label: str, previous_label: str, beats_after_previous: int,
+                          beats_per_bar: int) -> np.ndarray:
+        """
+        Shift the bar positions in labels (numbered 1 to beats_per_bar, as the bar and beat tracker labels them)
+        so that label comes beats_after_previous beats after previous_label.  Labels that aren't bar positions
+        are returned as is.
+        """
+        try:
+            shift = int(previous_label) + beats_after_previous - int(label)
+            positions = labels.astype(np.int64)
+        except ValueError:
+            return labels
+        return ((positions - 1 + shift) % beats_per_bar + 1).astype(str)
+
+    def _beat_tracking_window_settings(self) -> Optional[dict]:
+        """
+        :return: the settings that decide the windows of the parallel beat tracking, or None for a single pass
+        """
+        if self.stream_audio or self.beat_tracking_workers is None or self.beat_tracking_workers <= 1:
+            return None
+        return {"workers": self.beat_tracking_workers if self.beat_tracking_window_sec is None else None,
+                "window_sec": self.beat_tracking_window_sec, "overlap_sec": self.beat_tracking_window_overlap_sec}
+
+    def _beat_cache_key(self, plugin_identifier: str = None, plugin_parameters: dict = None,
+                        beat_tracking_windows: dict = None):
+        import soundfile as sf
+        if self.run_from == "audio_path":
+            audio_hash = self.beat_cache.hash_audio_file(self.input_audio_path)
+            audio_info = sf.info(str(self.input_audio_path))
+            sampling_rate = audio_info.samplerate
+            self.metrics.audio_duration_sec = audio_info.duration
+        else:
+            audio_hash = self.beat_cache.hash_audio_array(self.audio)
+            sampling_rate = self.sampling_rate
+        if self.beat_tracking_sampling_rate:
+            sampling_rate = self.beat_tracking_sampling_rate
+        return self.beat_cache.make_key(audio_hash,
+                                        plugin_identifier if plugin_identifier is not None else self.plugin_identifier,
+                                        plugin_parameters if plugin_parameters is not None else self.plugin_parameters,
+                                        sampling_rate, beat_tracking_windows)
+
+    def _calculate_beat_timestamps_from_run_source(self):
+        if self.run_from == "audio_path":
+            if self.stream_audio:
+                with self.metrics.stage("decode_and_beat_tracking"):
+                    self.calculate_beat_timestamps_from_audio_stream()
+                return
+            with self.metrics.stage("decode"):
+                self.load_audio_from_path()
+        elif self.audio is not None and self.sampling_rate:
+            self.metrics.audio_duration_sec = self.audio.shape[-1] / self.sampling_rate
+        if self.tempo_prepass and self.calculate_beat_timestamps_from_tempo_prepass():
+            return
+        self.calculate_beat_timestamps_from_vamp_plugin()
+
+    def calculate_beat_timestamps_with_cache(self):
+        if self.beat_cache is None:
+            self._calculate_beat_timestamps_from_run_source()
+            return
+        with self.metrics.stage("cache_lookup"):
+            cache_key = self._beat_cache_key(beat_tracking_windows=self._beat_tracking_window_settings())
+            cached_beats = self.beat_cache.load(cache_key) if not self.refresh_cache else None
+        if cached_beats is not None:
+            self.beats_timestamp_data = cached_beats
+            self.beats_from_cache = True
+            self.beat_tracking_path = "cache"
+            print("Beat timestamps loaded from cache {}".format(self.beat_cache.cache_dir))
+            return
+        self._calculate_beat_timestamps_from_run_source()
+        if self.beat_tracking_path == "plugin":  # Only the plugin's own beats belong under its cache key
+            with self.metrics.stage("cache_store"):
+                self.beat_cache.store(cache_key, self.beats_timestamp_data)
+
+    def _compared_plugins(self) -> List[tuple]:
+        """
+        :return: the (identifier, parameters) of each plugin to compare, starting with the main plugin,
+                 whose parameters are the only ones set
+        """
+        plugins = [(self.plugin_identifier, self.plugin_parameters)]
+        for plugin_identifier in self.compare_plugin_identifiers:
+            if plugin_identifier not in [identifier for identifier, _ in plugins]:
+                plugins.append((plugin_identifier, {}))
+        return plugins
+
+    def calculate_beat_timestamps_from_multiple_plugins(self):
+        """
+        Decode and preprocess the audio once, then run the main plugin and each compared plugin over it at the same
+        time, one process per plugin.  The beats of each plugin go in plugin_beats, and the beats that most of
+        the plugins agree on become the beat timestamps.  Plugins whose beats are cached aren't run again.
+
+        :return:
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        plugins = self._compared_plugins()
+        beats_per_bar = int(self.plugin_parameters.get("bpb", self.DEFAULT_BEATS_PER_BAR))
+        self.plugin_beats = {}
+        cache_keys = {}
+        if self.beat_cache is not None:
+            with self.metrics.stage("cache_lookup"):
+                for plugin_identifier, plugin_parameters in plugins:
+                    cache_keys[plugin_identifier] = self._beat_cache_key(plugin_identifier, plugin_parameters)
+                    cached_beats = self.beat_cache.load(cache_keys[plugin_identifier]) \
+                        if not self.refresh_cache else None
+                    if cached_beats is not None:
+                        self.plugin_beats[plugin_identifier] = cached_beats
+        missing_plugins = [plugin for plugin in plugins if plugin[0] not in self.plugin_beats]
+        self.beats_from_cache = not missing_plugins
+        self.beat_tracking_path = "plugin_comparison"
+
+        if missing_plugins:
+            if self.run_from == "audio_path":
+                with self.metrics.stage("decode"):
+                    self.load_audio_from_path()
+            elif self.sampling_rate:
+                self.metrics.audio_duration_sec = self.audio.shape[-1] / self.sampling_rate
+            with self.metrics.stage("preprocess"):
+                audio, sampling_rate = self.preprocess_audio_for_beat_tracking()
+            with self.metrics.stage("beat_tracking"), tempfile.TemporaryDirectory() as work_dir:
+                audio_path = os.path.join(work_dir, "audio.npy")
+                np.save(audio_path, audio)
+                del audio
+                with ProcessPoolExecutor(max_workers=len(missing_plugins)) as executor:
+                    futures = {plugin_identifier: executor.submit(_track_beats_in_shared_audio, audio_path,
+                                                                  sampling_rate, plugin_identifier,
+                                                                  plugin_parameters, beats_per_bar)
+                               for plugin_identifier, plugin_parameters in missing_plugins}
+                    for plugin_identifier, future in futures.items():
+                        self.plugin_beats[plugin_identifier] = future.result()
+            if self.beat_cache is not None:
+                with self.metrics.stage("cache_store"):
+                    for plugin_identifier, _ in missing_plugins:
+                        self.beat_cache.store(cache_keys[plugin_identifier], self.plugin_beats[plugin_identifier])
+        else:
+            print("Beat timestamps of all plugins loaded from cache {}".format(self.beat_cache.cache_dir))
+
+        with self.metrics.stage("consensus"):
+            self.beats_timestamp_data = consensus_beats([self.plugin_beats[plugin_identifier]
+                                                         for plugin_identifier, _ in plugins],
+                                                        self.CONSENSUS_TOLERANCE_SEC)
+
+    @staticmethod
+    def _plugin_output_name(plugin_identifier: str) -> str:
+        return re.sub(r"[^\w.-]", "_", plugin_identifier)
+
+    def write_plugin_outputs(self) -> dict:
+        """
+        Convert each compared plugin's beats to #OFFSET and #BPMS the same way as the consensus beats, and write
+        them to the compare output directory, if there is one.  Plugins with fewer than two beats are skipped.
+
+        :return: a summary of each plugin's beats and BPMs
+        """
+        if self.compare_output_dir is not None:
+            self.compare_output_dir.mkdir(parents=True, exist_ok=True)
+        plugin_summaries = {}
+        for plugin_identifier, beats in self.plugin_beats.items():
+            if len(beats) < 2:
+                # Not enough to give a tempo, and converting no beats would run the beat tracker again
+                warn("WARNING: Plugin {} found {} beats, so no #OFFSET or #BPMS were written for it."
+                     "".format(plugin_identifier, len(beats)))
+                plugin_summaries[plugin_identifier] = {"num_beats": len(beats), "offset": None, "num_bpms": 0,
+                                                       "skipped": "too few beats"}
+                continue
+            # A separate instance that only knows the plugin's beats, so none of this run's state is shared
+            output_path_stem = self.compare_output_dir / self._plugin_output_name(plugin_identifier) \
+                if self.compare_output_dir is not None else None
+            plugin_atbpm = AudioBeatsToBPMs(
+                beats=beats, sampling_rate=self.sampling_rate, interactive=False, use_cache=False,
+                max_bpm_drift_ms=self.max_bpm_drift_ms,
+                output_txt_path=output_path_stem.with_suffix(".txt") if output_path_stem is not None else None,
+                output_beat_markers_bpms_csv_path=output_path_stem.with_suffix(".csv")
+                if output_path_stem is not None else None)
+            plugin_atbpm.convert_timestamps_to_bpms()
+            if plugin_atbpm.max_bpm_drift_ms is not None:
+                plugin_atbpm.compact_bpms()
+            plugin_atbpm.convert_bpms_to_simfile_format()
+            if output_path_stem is not None:
+                plugin_atbpm.write_output_txt_oneline()
+                plugin_atbpm.write_output_csv()
+            plugin_summaries[plugin_identifier] = {"num_beats": len(beats), "offset": plugin_atbpm.offset,
+                                                   "num_bpms": len(plugin_atbpm.bpms_data.bpms)}
+        return plugin_summaries
+
     def load_beat_timestamps_from_path(self):
+        """
+        Load the beats from a CSV of timestamps and labels (in seconds, or in samples if the input beats sampling
+        rate is set), or from a .npy file written by --output_beats_path, which is memory-mapped.
+
+        :return:
+        """
         if self.input_beats_path is None:
             raise ValueError("No input beats path specified!")
         elif not self.input_beats_path.is_file():
             raise ValueError("Invalid path to input beats file {}".format(self.input_beats_path))
+        elif self.input_beats_path.suffix == self.BINARY_SUFFIX:
+            self.beats_timestamp_data = BeatsTimestampData.from_records(np.load(self.input_beats_path,
+                                                                                mmap_mode='r'))
+            if self.beats_timestamp_data.timestamp_type == 'samples' and not self.input_beats_in_samples:
+                raise ValueError("The beats in {} are in samples; please specify their sampling rate with "
+                                 "--input_beats_sampling_rate".format(self.input_beats_path))
+            elif self.beats_timestamp_data.timestamp_type == 'seconds' and self.input_beats_in_samples:
+                warn("The beats in {} are in seconds, but you specified the sampling rate, which will not be "
+                     "used in the computation.".format(self.input_beats_path))
+                self.input_beats_in_samples = False
         else:
             timestamp_type: str = 'unset'
-            with open(self.input_beats_path, "r") as infile:
-                read_data = []
-                csvread = csv.reader(infile)
-                row = next(csvread)
-                first_beat_time = float(row[0])
-                if not self.input_beats_in_samples:
+            # Read the whole file at once into a [rows, columns] string array, parsed by NumPy's C reader
+            with catch_warnings():
+                # Blank lines (such as a trailing one in a hand-edited CSV) are skipped, like csv.reader did, but
+                # NumPy warns that they don't count towards the max_rows of its internal chunks
+                filterwarnings("ignore", message=r"Input line \d+ contained no data", category=UserWarning)
+                columns = np.loadtxt(self.input_beats_path, dtype=str, delimiter=",", comments=None, quotechar='"',
+                                     ndmin=2)
+            if len(columns) == 0:
+                raise ValueError("No beats in the input beats file {}".format(self.input_beats_path))
+            first_beat_time = float(columns[0, 0])
+            if not self.input_beats_in_samples:
+                timestamp_type = 'seconds'
+                if first_beat_time > self.MIN_FIRST_BEAT_SEC_FOR_WARN:
+                    warn("WARNING: Your first timestamp {} from the input CSV is at greater than {} seconds. "
+                         "Are you sure the units are in seconds and not samples? "
+                         "If they are samples, please specify the sampling rate using the flag "
+                         "--samples; for instance --samples 48000, or "
+                         "otherwise you will get very inaccurate BPMs.".format(first_beat_time,
+                                                                               self.MIN_FIRST_BEAT_SEC_FOR_WARN))
+            else:
+                if int(first_beat_time) != first_beat_time:
+                    warn("The first beat time {} is detected to be in units of seconds, but you specified the "
+                         "sampling rate, which will not be used in the computation.")
                     timestamp_type = 'seconds'
-                    if first_beat_time > self.MIN_FIRST_BEAT_SEC_FOR_WARN:
-                        warn("WARNING: Your first timestamp {} from the input CSV is at greater than {} seconds. "
-                             "Are you sure the units are in seconds and not samples? "
-                             "If they are samples, please specify the sampling rate using the flag "
-                             "--samples; for instance --samples 48000, or "
-                             "otherwise you will get very inaccurate BPMs.".format(first_beat_time,
-                                                                                   self.MIN_FIRST_BEAT_SEC_FOR_WARN))
+                    self.input_beats_in_samples = False
                 else:
-                    if int(first_beat_time) != first_beat_time:
-                        warn("The first beat time {} is detected to be in units of seconds, but you specified the "
-                             "sampling rate, which will not be used in the computation.")
-                        timestamp_type = 'seconds'
-                        self.input_beats_in_samples = False
-                    else:
-                        timestamp_type = 'samples'
-                read_data.append(row)
-                for row in csvread:
-                    read_data.append(row)
-                self.beats_timestamp_data = self._convert_beats_data_from_lists_to_BeatsTimestampData(read_data,
-                                                                                                      timestamp_type)
+                    timestamp_type = 'samples'
+            self.beats_timestamp_data = BeatsTimestampData(timestamps=columns[:, 0].astype(np.float64),
+                                                           labels=columns[:, 1] if columns.shape[1] > 1 else None,
+                                                           timestamp_type=timestamp_type)
 
     def convert_timestamps_to_bpms(self):
-        if len(self.beats_timestamp_data.beats) == 0:
+        if len(self.beats_timestamp_data) == 0:
             try:
                 self.calculate_beat_timestamps_from_vamp_plugin()
             except ValueError:
                 raise ValueError("Beats data is empty; "
                                  "did you load an audio file or an input CSV of beat information?")
         else:
+            # A new BPM starts at every beat whose spacing to the next beat differs from the previous spacing
             if self.beats_timestamp_data.timestamp_type == 'samples':
-                first_beat_samples = int(self.beats_timestamp_data.beats[0].timestamp)
-                self.offset = - first_beat_samples / self.sampling_rate
-                beat_marker = 0
-                last_beat_diff = 0
-                for beat in self.beats_timestamp_data.beats[1:]:
-                    second_beat_samples = int(beat.timestamp)
-                    beat_diff = second_beat_samples - first_beat_samples
-                    if last_beat_diff != beat_diff:
-                        bpm = self.sampling_rate / beat_diff * 60  # CHANGE
-                        self.bpms_data.bpms.append(bpm)
-                        self.bpms_data.beat_markers.append(beat_marker)
-                    first_beat_samples = second_beat_samples
-                    beat_marker += 1
-                    last_beat_diff = beat_diff
+                beat_samples = self.beats_timestamp_data.timestamps.astype(np.int64)
+                self.offset = - int(beat_samples[0]) / self.sampling_rate
+                beat_diffs = np.diff(beat_samples)
+                last_beat_diffs = np.concatenate(([0], beat_diffs[:-1]))
+                change_points = beat_diffs != last_beat_diffs
+                bpms = self.sampling_rate / beat_diffs[change_points] * 60
             elif self.beats_timestamp_data.timestamp_type == 'seconds':
-                beat_marker = 0
-                last_beat_diff = 0
-                first_beat_sec = float(self.beats_timestamp_data.beats[0].timestamp)
-                self.offset = - first_beat_sec
-                for beat in self.beats_timestamp_data.beats[1:]:
-                    second_beat_sec = float(beat.timestamp)
-                    beat_diff = second_beat_sec - first_beat_sec
-                    if abs(last_beat_diff - beat_diff) > self.SEC_DIFF_TOLERANCE:
-                        bpm = 60 / beat_diff
-                        self.bpms_data.bpms.append(bpm)
-                        self.bpms_data.beat_markers.append(beat_marker)
-                    first_beat_sec = second_beat_sec
-                    beat_marker += 1
-                    last_beat_diff = beat_diff
+                beat_secs = self.beats_timestamp_data.timestamps
+                self.offset = - float(beat_secs[0])
+                beat_diffs = np.diff(beat_secs)
+                last_beat_diffs = np.concatenate(([0.], beat_diffs[:-1]))
+                change_points = np.abs(last_beat_diffs - beat_diffs) > self.SEC_DIFF_TOLERANCE
+                bpms = 60 / beat_diffs[change_points]
             else:
                 raise ValueError("Invalid timestamp_type: {}".format(self.beats_timestamp_data.timestamp_type))
+            self.bpms_data.set_bpms(bpms)
+            self.bpms_data.set_beat_markers(np.flatnonzero(change_points))
 
-    @staticmethod
-    def _convert_beats_data_from_dicts_to_BeatsTimestampData(beats_dicts: List[dict], timestamp_type: str):
-        return BeatsTimestampData([SingleBeatTimestampData(timestamp=beat_dict['timestamp'], label=beat_dict['label'])
-                                   for beat_dict in beats_dicts], timestamp_type)
+    def _beat_times_in_seconds(self) -> np.ndarray:
+        if self.beats_timestamp_data.timestamp_type == 'samples':
+            return self.beats_timestamp_data.timestamps.astype(np.int64) / self.sampling_rate
+        elif self.beats_timestamp_data.timestamp_type == 'seconds':
+            return self.beats_timestamp_data.timestamps
+        else:
+            raise ValueError("Invalid timestamp_type: {}".format(self.beats_timestamp_data.timestamp_type))
 
     @staticmethod
-    def _convert_beats_data_from_lists_to_BeatsTimestampData(beats_lists: List, timestamp_type: str):
-        return BeatsTimestampData([SingleBeatTimestampData(timestamp=beat_list[0], label=beat_list[1])
-                                   for beat_list in beats_lists], timestamp_type)
+    def _compact_beat_times_to_segments(beat_secs: np.ndarray, max_drift_sec: float):
+        """
+        Greedily find constant-BPM segments that cover the beats, such that every beat of the resulting
+        timing data is within max_drift_sec of the detected beat.  Each segment starts where the timing data of
+        the previous segment puts its first beat (not at the detected beat), so the drift bound holds for the
+        cumulative timing.  A segment is extended as long as some beat period keeps all of its beats in bounds:
+        each beat j constrains the period to an interval, and the running intersection of these intervals is
+        evaluated in vectorized chunks that double in size while the whole chunk stays feasible.  There is no
+        lookahead: a shorter segment, or a different period within the same one, could sometimes leave the next
+        segment an anchor that lets it run longer, so the number of segments isn't always the minimum.
 
-    @staticmethod
-    def _convert_beats_data_from_dicts_to_lists(beats_dicts: List[dict]):
-        return [[beat_dict['timestamp'], beat_dict['label']] for beat_dict in beats_dicts]
+        :return: beat markers (the beat index where each segment starts) and BPMs of the segments
+        """
+        last_beat = len(beat_secs) - 1
+        beat_markers = []
+        bpms = []
+        start = 0
+        start_sec = float(beat_secs[0])
+        while start < last_beat:
+            period_lo, period_hi = 0., np.inf
+            end = start
+            chunk_size = 64
+            while end < last_beat:
+                beat_indices = np.arange(end + 1, min(end + chunk_size, last_beat) + 1)
+                num_beats = beat_indices - start
+                lo = np.maximum.accumulate(np.maximum((beat_secs[beat_indices] - max_drift_sec - start_sec) / num_beats,
+                                                      period_lo))
+                hi = np.minimum.accumulate(np.minimum((beat_secs[beat_indices] + max_drift_sec - start_sec) / num_beats,
+                                                      period_hi))
+                infeasible = np.flatnonzero(lo > hi)
+                num_feasible = infeasible[0] if len(infeasible) else len(beat_indices)
+                if num_feasible == 0:
+                    break
+                period_lo, period_hi = lo[num_feasible - 1], hi[num_feasible - 1]
+                end = int(beat_indices[num_feasible - 1])
+                if num_feasible < len(beat_indices):
+                    break
+                chunk_size *= 2
+            if end == start:  # Can only happen with a zero drift bound and rounding error; take a single beat
+                end = start + 1
+                period_lo = period_hi = beat_secs[end] - start_sec
+            # Among the feasible periods, pick the one that lands the segment's last beat closest to its detected
+            # time, so the next segment starts with as little drift as possible
+            period = min(max((beat_secs[end] - start_sec) / (end - start), period_lo), period_hi)
+            beat_markers.append(start)
+            bpms.append(60 / period)
+            start_sec += (end - start) * period
+            start = end
+        return np.array(beat_markers, dtype=np.int64), np.array(bpms, dtype=np.float64)
 
     @staticmethod
-    def _convert_beats_data_from_lists_to_dicts(beats_list: List):
-        return [{'timestamp': beat_list[0], 'label': beat_list[1]} for beat_list in beats_list]
+    def _max_drift_sec(beat_secs: np.ndarray, beat_markers: np.ndarray, bpms: np.ndarray) -> float:
+        if len(beat_secs) < 2:
+            return 0.
+        segment_lengths = np.diff(np.append(beat_markers, len(beat_secs) - 1))
+        periods = np.repeat(60 / bpms, segment_lengths)
+        timing_secs = beat_secs[0] + np.concatenate(([0.], np.cumsum(periods)))
+        return float(np.max(np.abs(timing_secs - beat_secs)))
+
+    def compact_bpms(self, max_drift_ms: float = None):
+        """
+        Replace the BPMs with fewer BPM segments whose timing stays within max_drift_ms of every detected beat,
+        and record how many #BPMS entries were removed in self.bpm_compaction_report.  The segments are found
+        greedily, so the drift bound always holds but the number of segments isn't guaranteed to be the minimum.
+
+        :return:
+        """
+        if max_drift_ms is None:
+            max_drift_ms = self.max_bpm_drift_ms
+        if max_drift_ms is None or max_drift_ms < 0:
+            raise ValueError("Invalid maximum BPM drift {} ms, must be non-negative".format(max_drift_ms))
+        if len(self.beats_timestamp_data) < 2:
+            return
+        beat_secs = self._beat_times_in_seconds()
+        num_bpms_before = len(self.bpms_data.bpms)
+        beat_markers, bpms = self._compact_beat_times_to_segments(beat_secs, max_drift_ms / 1000)
+        self.bpms_data.set_beat_markers(beat_markers)
+        self.bpms_data.set_bpms(bpms)
+        self.simfile_bpms = None
+        self.bpm_compaction_report = {"num_bpms_before": num_bpms_before,
+                                      "num_bpms_after": len(bpms),
+                                      "num_bpms_removed": num_bpms_before - len(bpms),
+                                      "max_drift_ms": self._max_drift_sec(beat_secs, beat_markers, bpms) * 1000}
+        print("Compacted #BPMS from {num_bpms_before} to {num_bpms_after} entries ({num_bpms_removed} removed), "
+              "max drift {max_drift_ms:.3f} ms".format(**self.bpm_compaction_report))
 
     def convert_bpms_to_simfile_format(self):
         beats_bpms = ["{}={}\n".format(beat_marker, bpm) for beat_marker, bpm in
@@ -285,10 +1753,32 @@ class AudioBeatsToBPMs(object):
         self.simfile_bpms = ",".join(beats_bpms)
 
     def write_output_csv(self):
-        with open(self.output_beat_markers_bpms_csv_path, "w") as outfile:
-            csvwrite = csv.writer(outfile)
-            for beat_marker, bpm in zip(self.bpms_data.beat_markers, self.bpms_data.bpms):
-                csvwrite.writerow([beat_marker, bpm])
+        """
+        Write the beat markers and BPMs as CSV rows, or as BPMsData.to_records if the path ends in .npy
+
+        :return:
+        """
+        if self.output_beat_markers_bpms_csv_path.suffix == self.BINARY_SUFFIX:
+            np.save(self.output_beat_markers_bpms_csv_path, self.bpms_data.to_records())
+            return
+        rows = np.column_stack((self.bpms_data.beat_markers.astype(str), self.bpms_data.bpms.astype(str)))
+        np.savetxt(self.output_beat_markers_bpms_csv_path, rows, fmt="%s", delimiter=",", newline="\r\n")
+
+    def write_output_beats(self):
+        """
+        Write the beat timestamps and labels in the same format as the input beats CSV, or as
+        BeatsTimestampData.to_records if the path ends in .npy, which --input_beats_path loads without parsing
+
+        :return:
+        """
+        if self.output_beats_path.suffix == self.BINARY_SUFFIX:
+            np.save(self.output_beats_path, self.beats_timestamp_data.to_records())
+            return
+        timestamps = self.beats_timestamp_data.timestamps
+        if self.beats_timestamp_data.timestamp_type == 'samples':
+            timestamps = timestamps.astype(np.int64)
+        rows = np.column_stack((timestamps.astype(str), self.beats_timestamp_data.labels))
+        np.savetxt(self.output_beats_path, rows, fmt="%s", delimiter=",")
 
     def write_output_txt_oneline(self):
         """
@@ -312,42 +1802,90 @@ class AudioBeatsToBPMs(object):
             outfile.write(stepmania_bpms_out)
 
     def write_output_simfile(self):
-        sm = simfile.open(str(self.input_simfile_path))
-        sm.offset = self.offset
+        """
+        Write the input simfile to the output simfile path with its #OFFSET and #BPMS replaced.  By default only
+        those tags (song-level and per-chart) are rewritten and the rest of the file is copied byte for byte;
+        with full_simfile_rewrite, the whole simfile is parsed and re-serialized by the simfile library.
+        Either way, the output is written atomically.
+
+        :return:
+        """
         if self.simfile_bpms is None:
             self.convert_bpms_to_simfile_format()
-        sm.bpms = self.simfile_bpms
-        with open(self.output_simfile_path, 'w', encoding='utf-8') as outfile:
-            sm.serialize(outfile)
+        if self.full_simfile_rewrite:
+            import simfile
+            sm = simfile.open(str(self.input_simfile_path))
+            sm.offset = str(self.offset)
+            sm.bpms = self.simfile_bpms
+            output_data = str(sm).encode('utf-8')
+        else:
+            with open(self.input_simfile_path, 'rb') as infile:
+                output_data = patch_simfile_timing(infile.read(), str(self.offset), self.simfile_bpms)
+        atomic_write_bytes(self.output_simfile_path, output_data, mode_source=self.input_simfile_path)
 
     def run(self):
-        if self.run_from == "audio_path":
-            self.load_audio_from_path()
-            self.calculate_beat_timestamps_from_vamp_plugin()
-        elif self.run_from == "audio_input":
-            self.calculate_beat_timestamps_from_vamp_plugin()
+        if self.run_from in {"audio_path", "audio_input"} and self.compare_plugin_identifiers:
+            self.calculate_beat_timestamps_from_multiple_plugins()
+        elif self.run_from in {"audio_path", "audio_input"}:
+            self.calculate_beat_timestamps_with_cache()
         elif self.run_from == "beats_path":
-            self.load_beat_timestamps_from_path()
+            with self.metrics.stage("load_beats"):
+                self.load_beat_timestamps_from_path()
+            self.beat_tracking_path = "input_beats"
+        elif self.run_from == "beats_input":
+            self.beat_tracking_path = "input_beats"
         elif self.run_from in self.RUN_FROM_CANDIDATES:
             raise ValueError("Unsupported run_from option {}".format(self.run_from))
         else:
             raise ValueError("Invalid run configuration {}, must be one of the options "
                              "'{}'".format(self.run_from, "', '".join(self.RUN_FROM_CANDIDATES)))
-        self.convert_timestamps_to_bpms()
+        with self.metrics.stage("conversion"):
+            self.convert_timestamps_to_bpms()
+        if self.max_bpm_drift_ms is not None:
+            with self.metrics.stage("compaction"):
+                self.compact_bpms()
         if self.output_simfile_path is not None:
-            self.write_output_simfile()
+            with self.metrics.stage("simfile_write"):
+                self.write_output_simfile()
         if self.output_txt_path is not None:
-            self.write_output_txt_oneline()
+            with self.metrics.stage("txt_write"):
+                self.write_output_txt_oneline()
         if self.output_beat_markers_bpms_csv_path is not None:
-            self.write_output_csv()
+            with self.metrics.stage("csv_write"):
+                self.write_output_csv()
+        if self.output_beats_path is not None:
+            with self.metrics.stage("beats_write"):
+                self.write_output_beats()
+        if self.plugin_beats:
+            with self.metrics.stage("plugin_outputs"):
+                self.metrics.extra["plugins"] = self.write_plugin_outputs()
+        self.report_metrics()
 
+    def report_metrics(self):
+        self.metrics.num_beats = len(self.beats_timestamp_data)
+        self.metrics.num_bpms = len(self.bpms_data.bpms)
+        source_path = self.input_beats_path if self.run_from == "beats_path" else self.input_audio_path
+        self.metrics.extra.update({"source": str(source_path) if source_path is not None else None,
+                                   "run_from": self.run_from, "plugin_identifier": self.plugin_identifier,
+                                   "beats_from_cache": self.beats_from_cache,
+                                   "beat_tracking_path": self.beat_tracking_path})
+        if self.tempo_prepass_report is not None:
+            self.metrics.extra["tempo_prepass"] = self.tempo_prepass_report
+        metrics = self.metrics.to_dict()
+        if self.metrics_json_path is not None:
+            with open(self.metrics_json_path, "w") as outfile:
+                json.dump(metrics, outfile, indent=2)
+        for metrics_callback in self.metrics_callbacks:
+            metrics_callback(metrics)
 
-def main():
+
+def build_argument_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_audio_path", help="Path to input audio file")
     parser.add_argument("--input_beats_path", help="Path to input CSV file containing beat markers. "
                                                    "Use this if you have generated beat markers from the "
-                                                   "audio separately (using Sonic Visualiser for example)")
+                                                   "audio separately (using Sonic Visualiser for example), "
+                                                   "or a .npy file written by --output_beats_path")
     parser.add_argument("--input_beats_sampling_rate", help="Use this option if the input CSV's beat locations "
                                                             "are given in samples, "
                                                             "and specify the sampling rate in Hz.", type=int)
@@ -358,7 +1896,15 @@ def main():
     parser.add_argument("--output_txt_path", help="(OPTIONAL) Output path to text file where only the "
                                                   "#BPMS and #OFFSET lines will be written")
     parser.add_argument("--output_beat_markers_bpms_csv_path",
-                        help="(OPTIONAL) Path to output CSV with the beat markers and BPMs")
+                        help="(OPTIONAL) Path to output CSV with the beat markers and BPMs, or to a NumPy "
+                             "structured array of them if the path ends in .npy")
+    parser.add_argument("--output_beats_path", help="(OPTIONAL) Path to output CSV with the beat timestamps and "
+                                                    "labels, or to a NumPy structured array of them if the path "
+                                                    "ends in .npy, which --input_beats_path loads much faster")
+    parser.add_argument("--full_simfile_rewrite", help="(OPTIONAL) Parse and re-serialize the whole simfile with the "
+                                                       "simfile library, instead of only rewriting its #OFFSET and "
+                                                       "#BPMS tags and copying everything else as is",
+                        action="store_true")
     parser.add_argument("--overwrite_input_simfile", help="(OPTIONAL) Use this option to overwrite the "
                                                           "existing input simfile",
                         action="store_true")
@@ -369,18 +1915,110 @@ def main():
                                                               "error.  "
                                                               "Default plugin "
                                                               "used is {}".format(AudioBeatsToBPMs.PLUGIN_IDENTIFIER))
-    args = parser.parse_args()
+    parser.add_argument("--stream_audio", help="(OPTIONAL) Stream the input audio into the beat tracker block by "
+                                               "block instead of loading the whole file into memory; "
+                                               "use this for very long songs",
+                        action="store_true")
+    parser.add_argument("--beat_tracking_sampling_rate", help="(OPTIONAL) Resample the audio to this rate in Hz "
+                                                              "(for example 22050) before beat tracking, which is "
+                                                              "faster on 48 kHz or 96 kHz audio.  The beat times are "
+                                                              "unaffected apart from a small loss of accuracy.  "
+                                                              "Default is the audio file's own sampling rate",
+                        type=int)
+    parser.add_argument("--max_bpm_drift_ms", help="(OPTIONAL) Merge the detected BPMs into fewer #BPMS entries "
+                                                   "(greedily, so not always the fewest possible), such that no beat "
+                                                   "drifts from its detected time by more than this many "
+                                                   "milliseconds.  Without this option, "
+                                                   "every change in beat spacing gets its own #BPMS entry",
+                        type=float)
+    parser.add_argument("--metrics_json_path", help="(OPTIONAL) Path to output JSON file with the wall time, "
+                                                    "CPU time and peak memory of each stage, the audio duration, "
+                                                    "and the number of beats and #BPMS entries")
+    parser.add_argument("--no_cache", help="(OPTIONAL) Don't read or write the on-disk cache of detected beats",
+                        action="store_true")
+    parser.add_argument("--refresh_cache", help="(OPTIONAL) Ignore any cached beats for this audio and run the "
+                                                "beat tracker again, then update the cache",
+                        action="store_true")
+    parser.add_argument("--cache_dir", help="(OPTIONAL) Directory of the cache of detected beats.  "
+                                            "Default is {}".format(BeatTimestampCache.DEFAULT_CACHE_DIR))
+    parser.add_argument("--cache_max_size_mb", help="(OPTIONAL) Maximum size of the cache of detected beats in MB; "
+                                                    "the least recently used entries are removed past this size.  "
+                                                    "Default is {}".format(BeatTimestampCache.DEFAULT_MAX_SIZE_BYTES
+                                                                           // 1024 ** 2),
+                        type=float)
+    parser.add_argument("--beat_tracking_workers", help="(OPTIONAL) Track the beats of overlapping windows of the "
+                                                        "audio in this many processes and stitch them together; "
+                                                        "use this for very long songs.  Default is a single pass "
+                                                        "over the whole song",
+                        type=int)
+    parser.add_argument("--beat_tracking_window_sec", help="(OPTIONAL) Length of the windows tracked in parallel.  "
+                                                           "Default is one window per worker",
+                        type=float)
+    parser.add_argument("--beat_tracking_window_overlap_sec", help="(OPTIONAL) Overlap between the windows tracked "
+                                                                   "in parallel.  Default is "
+                                                                   "{:g}".format(AudioBeatsToBPMs
+                                                                                 .DEFAULT_WINDOW_OVERLAP_SEC),
+                        type=float)
+    parser.add_argument("--compare_plugin_identifiers", help="(OPTIONAL) Also run these Vamp plugins (for example "
+                                                             "'qm-vamp-plugins:qm-tempotracker:beats', where the "
+                                                             "optional last part names the plugin output with the "
+                                                             "beats) at the same time on the same decoded audio, and "
+                                                             "use the beats that most of the plugins agree on",
+                        nargs="+")
+    parser.add_argument("--compare_output_dir", help="(OPTIONAL) Directory where the #OFFSET/#BPMS text and the beat "
+                                                     "markers/BPMs CSV of each compared plugin will be written")
+    parser.add_argument("--tempo_prepass", help="(OPTIONAL) First estimate a single tempo and offset from the "
+                                                "audio's onsets, which is much faster than the beat tracker, and "
+                                                "use them as is if the song's tempo is steady enough.  Otherwise "
+                                                "fall back to the beat tracker",
+                        action="store_true")
+    parser.add_argument("--tempo_prepass_min_confidence", help="(OPTIONAL) Confidence of the estimated tempo, "
+                                                               "over the whole song and in every 30 second region, "
+                                                               "needed to skip the beat tracker: 0 when its beats "
+                                                               "land on onsets no more often than chance, 1 when "
+                                                               "they all do.  Default is {:g}".format(
+                                                                   AudioBeatsToBPMs
+                                                                   .DEFAULT_TEMPO_PREPASS_MIN_CONFIDENCE),
+                        type=float)
+    parser.add_argument("--tempo_prepass_unstable_regions_only", help="(OPTIONAL) When the tempo isn't steady "
+                                                                      "enough, only run the beat tracker on the "
+                                                                      "parts of the song where it isn't, and keep "
+                                                                      "the estimated tempo everywhere else",
+                        action="store_true")
+    return parser
+
+
+def atbpm_kwargs_from_args(args: argparse.Namespace) -> dict:
+    return dict(input_audio_path=args.input_audio_path, input_beats_path=args.input_beats_path,
+                input_beats_sampling_rate=args.input_beats_sampling_rate,
+                input_simfile_path=args.input_simfile_path, output_simfile_path=args.output_simfile_path,
+                output_txt_path=args.output_txt_path,
+                output_beat_markers_bpms_csv_path=args.output_beat_markers_bpms_csv_path,
+                output_beats_path=args.output_beats_path,
+                overwrite_input_simfile=args.overwrite_input_simfile,
+                alternate_plugin_identifier=args.alternate_plugin_identifier,
+                use_cache=not args.no_cache, refresh_cache=args.refresh_cache,
+                cache_dir=args.cache_dir, cache_max_size_mb=args.cache_max_size_mb,
+                stream_audio=args.stream_audio, max_bpm_drift_ms=args.max_bpm_drift_ms,
+                metrics_json_path=args.metrics_json_path,
+                beat_tracking_sampling_rate=args.beat_tracking_sampling_rate,
+                full_simfile_rewrite=args.full_simfile_rewrite,
+                beat_tracking_workers=args.beat_tracking_workers,
+                beat_tracking_window_sec=args.beat_tracking_window_sec,
+                beat_tracking_window_overlap_sec=args.beat_tracking_window_overlap_sec,
+                compare_plugin_identifiers=args.compare_plugin_identifiers,
+                compare_output_dir=args.compare_output_dir, tempo_prepass=args.tempo_prepass,
+                tempo_prepass_min_confidence=args.tempo_prepass_min_confidence,
+                tempo_prepass_unstable_regions_only=args.tempo_prepass_unstable_regions_only)
+
+
+def main():
+    args = build_argument_parser().parse_args()
 
     if args.input_beats_sampling_rate is not None:
         pass
 
-    atbpm = AudioBeatsToBPMs(input_audio_path=args.input_audio_path, input_beats_path=args.input_beats_path,
-                             input_beats_sampling_rate=args.input_beats_sampling_rate,
-                             input_simfile_path=args.input_simfile_path, output_simfile_path=args.output_simfile_path,
-                             output_txt_path=args.output_txt_path,
-                             output_beat_markers_bpms_csv_path=args.output_beat_markers_bpms_csv_path,
-                             overwrite_input_simfile=args.overwrite_input_simfile,
-                             alternate_plugin_identifier=args.alternate_plugin_identifier)
+    atbpm = AudioBeatsToBPMs(**atbpm_kwargs_from_args(args))
     atbpm.run()
 
 
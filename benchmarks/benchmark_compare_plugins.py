@@ -0,0 +1,76 @@
+"""
+Benchmark comparing several beat detection plugins in one run (--compare_plugin_identifiers), which decodes the
+audio once and runs the plugins at the same time, against one full run per plugin, on a synthetic song.
+
+Sample command:
+    python3 benchmarks/benchmark_compare_plugins.py --plugin_identifiers qm-vamp-plugins:qm-barbeattracker \
+        qm-vamp-plugins:qm-tempotracker:beats beatroot-vamp:beatroot
+"""
+import argparse
+import json
+import pathlib
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from autogen_simfile_bpms import AudioBeatsToBPMs  # noqa: E402
+import synthetic_tempo_maps as synth  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark comparing beat detection plugins in one run")
+    parser.add_argument("--plugin_identifiers", help="Plugins to compare; the first one is the main plugin",
+                        nargs="+",
+                        default=[AudioBeatsToBPMs.PLUGIN_IDENTIFIER, "qm-vamp-plugins:qm-tempotracker:beats"])
+    parser.add_argument("--duration_sec", help="Duration of the synthetic song", type=float, default=600.)
+    parser.add_argument("--tempo_map", help="Tempo map of the synthetic song", choices=list(synth.TEMPO_MAPS),
+                        default="stepped")
+    parser.add_argument("--output_json", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {"separate_runs": {}}
+    true_beat_times = synth.TEMPO_MAPS[args.tempo_map](args.duration_sec)
+    with tempfile.TemporaryDirectory() as work_dir:
+        audio_path = pathlib.Path(work_dir) / "song.wav"
+        synth.write_click_track(audio_path, true_beat_times, args.duration_sec)
+
+        for plugin_identifier in args.plugin_identifiers:
+            atbpm = AudioBeatsToBPMs(input_audio_path=audio_path, alternate_plugin_identifier=plugin_identifier,
+                                     interactive=False, use_cache=False)
+            start_wall = time.perf_counter()
+            atbpm.run()
+            results["separate_runs"][plugin_identifier] = {
+                "wall_sec": time.perf_counter() - start_wall,
+                "f_measure_vs_truth": synth.beat_f_measure(atbpm.beats_timestamp_data.timestamps, true_beat_times)}
+
+        atbpm = AudioBeatsToBPMs(input_audio_path=audio_path, alternate_plugin_identifier=args.plugin_identifiers[0],
+                                 compare_plugin_identifiers=args.plugin_identifiers[1:], interactive=False,
+                                 use_cache=False)
+        start_wall = time.perf_counter()
+        atbpm.run()
+        results["compare_run"] = {
+            "wall_sec": time.perf_counter() - start_wall, "stages": atbpm.metrics.stages,
+            "consensus_f_measure_vs_truth": synth.beat_f_measure(atbpm.beats_timestamp_data.timestamps,
+                                                                 true_beat_times),
+            "plugin_f_measure_vs_truth": {plugin_identifier: synth.beat_f_measure(beats.timestamps, true_beat_times)
+                                          for plugin_identifier, beats in atbpm.plugin_beats.items()}}
+
+    separate_sec = sum(result["wall_sec"] for result in results["separate_runs"].values())
+    for plugin_identifier, result in results["separate_runs"].items():
+        print("{:<45} {:8.2f} s, F-measure vs truth {:.3f}".format(plugin_identifier, result["wall_sec"],
+                                                                     result["f_measure_vs_truth"]))
+    print("Separate runs: {:.2f} s in total".format(separate_sec))
+    print("One compare run: {:.2f} s ({:.2f}x faster), consensus F-measure vs truth {:.3f}".format(
+        results["compare_run"]["wall_sec"], separate_sec / results["compare_run"]["wall_sec"],
+        results["compare_run"]["consensus_f_measure_vs_truth"]))
+    for stage_name, stage in results["compare_run"]["stages"].items():
+        print("    {:<14} {:9.4f} s wall".format(stage_name, stage["wall_sec"]))
+
+    if args.output_json is not None:
+        with open(args.output_json, "w") as outfile:
+            json.dump({"args": vars(args), "results": results}, outfile, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark beat tracking in parallel overlapping windows (--beat_tracking_workers) against a single pass over
+the whole song, on long synthetic songs: the wall time for each number of workers, and how closely the
+stitched beats and bar labels match the single pass output.
+
+Sample command:
+    python3 benchmarks/benchmark_parallel_beat_tracking.py --duration_min 60 --workers 2 4 8
+"""
+import argparse
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from autogen_simfile_bpms import AudioBeatsToBPMs  # noqa: E402
+import synthetic_tempo_maps as synth  # noqa: E402
+
+
+F_MEASURE_THRESHOLD = 0.98  # Minimum F-measure of the stitched beats against the single pass beats to pass
+MATCH_TOLERANCE_SEC = 0.02
+
+
+def match_beats(beat_times: np.ndarray, reference_beat_times: np.ndarray):
+    """
+    :return: the index of the nearest reference beat for each beat, and whether it is within MATCH_TOLERANCE_SEC
+    """
+    nearest = np.clip(np.searchsorted(reference_beat_times, beat_times), 1, len(reference_beat_times) - 1)
+    nearest -= (beat_times - reference_beat_times[nearest - 1]) < (reference_beat_times[nearest] - beat_times)
+    return nearest, np.abs(reference_beat_times[nearest] - beat_times) <= MATCH_TOLERANCE_SEC
+
+
+def labels_are_continuous(labels: np.ndarray, beats_per_bar: int) -> bool:
+    # Every beat's bar position follows the previous one's, across the window seams too
+    positions = labels.astype(np.int64)
+    return bool(np.all((positions[1:] - positions[:-1]) % beats_per_bar == 1))
+
+
+def track_beats(atbpm: AudioBeatsToBPMs, workers: int = None):
+    atbpm.beat_tracking_workers = workers
+    start_wall = time.perf_counter()
+    beats = atbpm.calculate_beat_timestamps_from_vamp_plugin(return_beats=True)
+    return beats, time.perf_counter() - start_wall
+
+
+def benchmark_case(case_name: str, true_beat_times: np.ndarray, duration_sec: float, work_dir: pathlib.Path,
+                   args) -> list:
+    audio_path = work_dir / "{}.wav".format(case_name)
+    synth.write_click_track(audio_path, true_beat_times, duration_sec, args.sampling_rate, channels=1)
+    atbpm = AudioBeatsToBPMs(input_audio_path=audio_path, interactive=False, use_cache=False,
+                             beat_tracking_window_overlap_sec=args.window_overlap_sec)
+    atbpm.load_audio_from_path()
+
+    single_beats, single_sec = track_beats(atbpm)
+    results = [{"case": case_name, "workers": 1, "windows": 1, "wall_sec": single_sec, "speedup": 1.,
+                "num_beats": len(single_beats), "f_measure_vs_single": 1., "max_error_vs_single_ms": 0.,
+                "label_agreement_vs_single": 1.,
+                "labels_continuous": labels_are_continuous(single_beats.labels, synth.BEATS_PER_BAR),
+                "f_measure_vs_truth": synth.beat_f_measure(single_beats.timestamps, true_beat_times), "ok": True}]
+    for workers in args.workers:
+        beats, wall_sec = track_beats(atbpm, workers)
+        nearest, matched = match_beats(beats.timestamps, single_beats.timestamps)
+        f_measure = synth.beat_f_measure(beats.timestamps, single_beats.timestamps, tolerance_sec=MATCH_TOLERANCE_SEC)
+        result = {"case": case_name, "workers": workers, "windows": atbpm.metrics.extra["beat_tracking_windows"],
+                  "wall_sec": wall_sec, "speedup": single_sec / wall_sec, "num_beats": len(beats),
+                  "f_measure_vs_single": f_measure,
+                  "max_error_vs_single_ms": float(np.max(np.abs(
+                      beats.timestamps[matched] - single_beats.timestamps[nearest[matched]])) * 1000)
+                  if matched.any() else None,
+                  # The bar tracker may settle on a different downbeat in each window, so this is informative only
+                  "label_agreement_vs_single": float(np.mean(beats.labels[matched]
+                                                             == single_beats.labels[nearest[matched]])),
+                  "labels_continuous": labels_are_continuous(beats.labels, synth.BEATS_PER_BAR),
+                  "f_measure_vs_truth": synth.beat_f_measure(beats.timestamps, true_beat_times)}
+        result["ok"] = f_measure >= F_MEASURE_THRESHOLD and result["labels_continuous"]
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel windowed beat tracking")
+    parser.add_argument("--duration_min", help="Duration of each synthetic song", type=float, default=30.)
+    parser.add_argument("--sampling_rate", help="Sampling rate of the synthetic audio", type=int, default=44100)
+    parser.add_argument("--workers", help="Numbers of workers to compare against the single pass", type=int,
+                        nargs="+", default=sorted({2, 4, os.cpu_count() or 1} - {1}))
+    parser.add_argument("--window_overlap_sec", help="Overlap between the windows", type=float,
+                        default=AudioBeatsToBPMs.DEFAULT_WINDOW_OVERLAP_SEC)
+    parser.add_argument("--output_json", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    duration_sec = args.duration_min * 60
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for map_name, tempo_map in synth.TEMPO_MAPS.items():
+            case_results = benchmark_case(map_name, tempo_map(duration_sec=duration_sec), duration_sec,
+                                          pathlib.Path(work_dir), args)
+            results.extend(case_results)
+            print("{}:".format(map_name))
+            for result in case_results:
+                print("    {:>2} workers ({:>2} windows): {:8.2f} s ({:5.2f}x), {} beats, F-measure vs single pass "
+                      "{:.4f}, labels agree {:.3f}, labels continuous {}, F-measure vs truth {:.3f}: {}".format(
+                          result["workers"], result["windows"], result["wall_sec"], result["speedup"],
+                          result["num_beats"], result["f_measure_vs_single"], result["label_agreement_vs_single"],
+                          result["labels_continuous"], result["f_measure_vs_truth"],
+                          "ok" if result["ok"] else "FAILED"))
+
+    if args.output_json is not None:
+        with open(args.output_json, "w") as outfile:
+            json.dump({"args": vars(args), "results": results}, outfile, indent=2)
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
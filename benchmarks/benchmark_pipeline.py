@@ -0,0 +1,231 @@
+"""
+Benchmark the stages of AudioBeatsToBPMs on synthetic songs with known tempo maps, and check the produced
+#OFFSET/#BPMS against the ground truth.  Everything is generated offline, so no external data is needed.
+
+Sample commands:
+    python3 benchmarks/benchmark_pipeline.py --output_json bench.json
+    python3 benchmarks/benchmark_pipeline.py --skip_audio --csv_beats 200000 --compare_json bench.json
+"""
+import argparse
+import json
+import pathlib
+import re
+import sys
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from autogen_simfile_bpms import AudioBeatsToBPMs, BeatsTimestampData, PipelineMetrics, \
+    SingleBeatTimestampData  # noqa: E402
+import synthetic_tempo_maps as synth  # noqa: E402
+
+
+AUDIO_F_MEASURE_THRESHOLD = 0.9  # Minimum beat F-measure of the output timing for an audio case to pass
+CSV_ERROR_TOLERANCE_MS = 0.05  # Maximum beat error of the output timing for a CSV case to pass, plus any drift bound
+
+
+def _time_stage(stage_name: str, function, metrics: PipelineMetrics, trace_memory: bool):
+    # Timed by the same PipelineMetrics.stage as a normal run, plus the tracemalloc peak if asked for
+    if trace_memory:
+        tracemalloc.reset_peak()
+    with metrics.stage(stage_name):
+        function()
+    if trace_memory:
+        metrics.stages[stage_name]["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+
+
+def parse_offset_and_bpms(simfile_text: str):
+    offset = float(re.search(r"#OFFSET:([^;]*);", simfile_text).group(1))
+    beat_markers, bpms = [], []
+    for beat_and_bpm in re.search(r"#BPMS:([^;]*);", simfile_text).group(1).split(","):
+        if beat_and_bpm.strip():
+            beat, bpm = beat_and_bpm.split("=")
+            beat_markers.append(int(round(float(beat))))
+            bpms.append(float(bpm))
+    return offset, np.array(beat_markers), np.array(bpms)
+
+
+def check_timing(output_path: pathlib.Path, num_beats: int, true_beat_times: np.ndarray) -> dict:
+    # Read back what was actually written, rather than the in-memory state
+    offset, beat_markers, bpms = parse_offset_and_bpms(output_path.read_text())
+    timing_beat_times = synth.timing_beat_times(offset, beat_markers, bpms, num_beats)
+    errors = synth.beat_time_errors(timing_beat_times, true_beat_times)
+    return {"num_bpms": len(bpms),
+            "offset_error_ms": float(synth.beat_time_errors(np.array([-offset]), true_beat_times)[0] * 1000),
+            "median_beat_error_ms": float(np.median(errors) * 1000),
+            "max_beat_error_ms": float(np.max(errors) * 1000),
+            "f_measure": synth.beat_f_measure(timing_beat_times, true_beat_times)}
+
+
+def _beats_per_sec(stages: dict, stage_name: str, num_beats: int) -> float:
+    return num_beats / stages[stage_name]["wall_sec"] if stages[stage_name]["wall_sec"] > 0 else float("inf")
+
+
+def benchmark_audio_case(case_name: str, true_beat_times: np.ndarray, duration_sec: float, work_dir: pathlib.Path,
+                         args, channels: int = 2) -> dict:
+    audio_path = work_dir / "{}.wav".format(case_name)
+    simfile_path = work_dir / "{}.sm".format(case_name)
+    synth.write_click_track(audio_path, true_beat_times, duration_sec, args.sampling_rate, channels)
+    synth.write_simfile(simfile_path, audio_path.name)
+
+    atbpm = AudioBeatsToBPMs(input_audio_path=audio_path, input_simfile_path=simfile_path,
+                             output_simfile_path=work_dir / "{}.out.sm".format(case_name), interactive=False,
+                             use_cache=False, max_bpm_drift_ms=args.max_bpm_drift_ms)
+    metrics = PipelineMetrics()
+    _time_stage("decode", atbpm.load_audio_from_path, metrics, args.trace_memory)
+    _time_stage("beat_tracking", atbpm.calculate_beat_timestamps_from_vamp_plugin, metrics, args.trace_memory)
+    _time_stage("conversion", lambda: _convert(atbpm), metrics, args.trace_memory)
+    _time_stage("simfile_write", atbpm.write_output_simfile, metrics, args.trace_memory)
+    stages = metrics.stages
+
+    num_beats = len(atbpm.beats_timestamp_data)
+    result = {"case": case_name, "kind": "audio", "audio_duration_sec": duration_sec, "num_beats": num_beats,
+              "stages": stages, "beat_tracking_beats_per_sec": _beats_per_sec(stages, "beat_tracking", num_beats),
+              "realtime_factor": duration_sec / sum(stage["wall_sec"] for stage in stages.values())}
+    result["accuracy"] = check_timing(atbpm.output_simfile_path, num_beats, true_beat_times)
+    result["ok"] = result["accuracy"]["f_measure"] >= AUDIO_F_MEASURE_THRESHOLD
+    return result
+
+
+def check_beats_list(beats_path: pathlib.Path) -> bool:
+    """
+    Check the list operations of BeatsTimestampData.beats against a plain list, on the first beats of a
+    memory-mapped .npy beats file
+    """
+    beats = BeatsTimestampData.from_records(np.load(beats_path, mmap_mode='r')[:4])
+    beat_list = beats.beats
+    expected = list(zip(beats.timestamps.tolist(), beats.labels.tolist()))
+    beat_list[0], beat_list[1] = beat_list[1], beat_list[0]
+    expected[0], expected[1] = expected[1], expected[0]
+    beat_list.reverse()
+    expected.reverse()
+    first_beat = beat_list[0]
+    beat_list.insert(0, SingleBeatTimestampData(-1., "inserted"))
+    expected.insert(0, (-1., "inserted"))
+    found = first_beat in beat_list and beat_list.index(first_beat) == 1 and beat_list[1].timestamp == expected[1][0]
+    beat_list.remove(first_beat)
+    del expected[1]
+    return found and list(zip(beats.timestamps.tolist(), beats.labels.tolist())) == expected
+
+
+def benchmark_csv_case(case_name: str, true_beat_times: np.ndarray, work_dir: pathlib.Path, args,
+                       sampling_rate: int = None, binary: bool = False) -> dict:
+    if binary:
+        # The .npy beats format that --output_beats_path writes, and --input_beats_path memory-maps
+        beats_path = work_dir / "{}.npy".format(case_name)
+        beats = BeatsTimestampData(timestamps=true_beat_times, labels=synth.beat_labels(len(true_beat_times)),
+                                   timestamp_type='seconds')
+        np.save(beats_path, beats.to_records())
+    else:
+        beats_path = work_dir / "{}.csv".format(case_name)
+        synth.write_beats_csv(beats_path, true_beat_times, sampling_rate)
+
+    atbpm = AudioBeatsToBPMs(input_beats_path=beats_path, input_beats_sampling_rate=sampling_rate,
+                             output_txt_path=work_dir / "{}.txt".format(case_name), interactive=False,
+                             max_bpm_drift_ms=args.max_bpm_drift_ms)
+    metrics = PipelineMetrics()
+    _time_stage("load_beats", atbpm.load_beat_timestamps_from_path, metrics, args.trace_memory)
+    _time_stage("conversion", lambda: _convert(atbpm), metrics, args.trace_memory)
+    _time_stage("txt_write", atbpm.write_output_txt_oneline, metrics, args.trace_memory)
+    stages = metrics.stages
+
+    num_beats = len(atbpm.beats_timestamp_data)
+    result = {"case": case_name, "kind": "csv", "num_beats": num_beats, "stages": stages,
+              "load_beats_per_sec": _beats_per_sec(stages, "load_beats", num_beats),
+              "conversion_beats_per_sec": _beats_per_sec(stages, "conversion", num_beats)}
+    result["accuracy"] = check_timing(atbpm.output_txt_path, num_beats, true_beat_times)
+    tolerance_ms = CSV_ERROR_TOLERANCE_MS + (args.max_bpm_drift_ms or 0.)
+    result["ok"] = result["accuracy"]["max_beat_error_ms"] <= tolerance_ms
+    if binary:
+        result["beats_list_ok"] = check_beats_list(beats_path)
+        result["ok"] = result["ok"] and result["beats_list_ok"]
+    return result
+
+
+def _convert(atbpm: AudioBeatsToBPMs):
+    atbpm.convert_timestamps_to_bpms()
+    if atbpm.max_bpm_drift_ms is not None:
+        atbpm.compact_bpms()
+    atbpm.convert_bpms_to_simfile_format()
+
+
+def print_result(result: dict, baseline: dict = None):
+    status = "ok" if result["ok"] else "FAILED"
+    print("{} ({} beats, {} #BPMS entries, max beat error {:.3f} ms, F-measure {:.3f}): {}".format(
+        result["case"], result["num_beats"], result["accuracy"]["num_bpms"],
+        result["accuracy"]["max_beat_error_ms"], result["accuracy"]["f_measure"], status))
+    for stage_name, stage in result["stages"].items():
+        line = "    {:<14} {:9.4f} s wall {:9.4f} s cpu".format(stage_name, stage["wall_sec"], stage["cpu_sec"])
+        if stage["peak_rss_mb"] is not None:  # Not available on Windows
+            line += " {:9.1f} MB peak RSS".format(stage["peak_rss_mb"])
+        if "peak_traced_mb" in stage:
+            line += " {:9.1f} MB peak traced".format(stage["peak_traced_mb"])
+        if baseline is not None and stage_name in baseline["stages"] and baseline["stages"][stage_name]["wall_sec"]:
+            line += "  ({:.2f}x baseline)".format(stage["wall_sec"] / baseline["stages"][stage_name]["wall_sec"])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark AutogenSimfileBPMs on synthetic tempo maps")
+    parser.add_argument("--duration_sec", help="Duration of each synthetic song", type=float, default=180.)
+    parser.add_argument("--long_duration_min", help="Duration of the long synthetic song (steady tempo, mono), "
+                                                    "or 0 to skip it", type=float, default=10.)
+    parser.add_argument("--sampling_rate", help="Sampling rate of the synthetic audio", type=int, default=44100)
+    parser.add_argument("--csv_beats", help="Approximate number of beats in each synthetic beats CSV", type=int,
+                        default=100000)
+    parser.add_argument("--max_bpm_drift_ms", help="Run the BPM compaction stage with this drift bound", type=float)
+    parser.add_argument("--skip_audio", help="Only run the beats CSV cases, which don't need the Vamp plugin",
+                        action="store_true")
+    parser.add_argument("--skip_csv", help="Only run the audio cases", action="store_true")
+    parser.add_argument("--trace_memory", help="Also report the peak memory allocated in each stage using "
+                                               "tracemalloc (slows down the pure Python parts)",
+                        action="store_true")
+    parser.add_argument("--output_json", help="Write the results to this JSON file")
+    parser.add_argument("--compare_json", help="Compare the stage times with the results of a previous run")
+    args = parser.parse_args()
+
+    baselines = {}
+    if args.compare_json is not None:
+        with open(args.compare_json, "r") as infile:
+            baselines = {result["case"]: result for result in json.load(infile)["results"]}
+    if args.trace_memory:
+        tracemalloc.start()
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = pathlib.Path(work_dir)
+        cases = []
+        if not args.skip_audio:
+            for map_name, tempo_map in synth.TEMPO_MAPS.items():
+                cases.append(lambda map_name=map_name, tempo_map=tempo_map: benchmark_audio_case(
+                    "audio_" + map_name, tempo_map(args.duration_sec), args.duration_sec, work_dir, args))
+            if args.long_duration_min > 0:
+                long_duration_sec = args.long_duration_min * 60
+                cases.append(lambda: benchmark_audio_case(
+                    "audio_long_steady", synth.steady_beat_times(duration_sec=long_duration_sec), long_duration_sec,
+                    work_dir, args, channels=1))
+        if not args.skip_csv:
+            csv_duration_sec = args.csv_beats * 0.5  # About 120 BPM on average
+            for map_name, tempo_map in synth.TEMPO_MAPS.items():
+                cases.append(lambda map_name=map_name, tempo_map=tempo_map: benchmark_csv_case(
+                    "csv_seconds_" + map_name, tempo_map(csv_duration_sec), work_dir, args))
+                cases.append(lambda map_name=map_name, tempo_map=tempo_map: benchmark_csv_case(
+                    "csv_samples_" + map_name, tempo_map(csv_duration_sec), work_dir, args, sampling_rate=48000))
+                cases.append(lambda map_name=map_name, tempo_map=tempo_map: benchmark_csv_case(
+                    "npy_seconds_" + map_name, tempo_map(csv_duration_sec), work_dir, args, binary=True))
+        for case in cases:
+            result = case()
+            results.append(result)
+            print_result(result, baselines.get(result["case"]))
+
+    if args.output_json is not None:
+        with open(args.output_json, "w") as outfile:
+            json.dump({"args": vars(args), "results": results}, outfile, indent=2)
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark the downmix/resample stage before beat tracking: for each target sampling rate, the time spent
+preprocessing and beat tracking, and the beat time error added relative to tracking at the native rate.
+
+Sample commands:
+    python3 benchmarks/benchmark_resample.py --native_sampling_rate 48000 --target_sampling_rates 32000 22050 16000
+    python3 benchmarks/benchmark_resample.py --resampler_only
+"""
+import argparse
+import json
+import pathlib
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from autogen_simfile_bpms import AudioBeatsToBPMs, PolyphaseResampler  # noqa: E402
+import synthetic_tempo_maps as synth  # noqa: E402
+
+
+def benchmark_resampler(native_sampling_rate: int, target_sampling_rate: int, duration_sec: float) -> dict:
+    signal = np.random.default_rng(0).uniform(-1., 1., int(native_sampling_rate * duration_sec)).astype(np.float32)
+    start_wall = time.perf_counter()
+    PolyphaseResampler(native_sampling_rate, target_sampling_rate).resample(signal)
+    wall_sec = time.perf_counter() - start_wall
+    return {"target_sampling_rate": target_sampling_rate, "wall_sec": wall_sec,
+            "input_samples_per_sec": len(signal) / wall_sec}
+
+
+def track_beats(audio_path: pathlib.Path, beat_tracking_sampling_rate: int = None):
+    atbpm = AudioBeatsToBPMs(input_audio_path=audio_path, interactive=False, use_cache=False,
+                             beat_tracking_sampling_rate=beat_tracking_sampling_rate)
+    atbpm.load_audio_from_path()
+    atbpm.calculate_beat_timestamps_from_vamp_plugin()
+    stages = atbpm.metrics.stages
+    return atbpm.beats_timestamp_data.timestamps, stages["preprocess"]["wall_sec"] + stages["beat_tracking"]["wall_sec"]
+
+
+def benchmark_case(case_name: str, true_beat_times: np.ndarray, duration_sec: float, work_dir: pathlib.Path,
+                   args) -> list:
+    audio_path = work_dir / "{}.wav".format(case_name)
+    synth.write_click_track(audio_path, true_beat_times, duration_sec, args.native_sampling_rate)
+    native_beats, native_sec = track_beats(audio_path)
+    results = [{"case": case_name, "sampling_rate": args.native_sampling_rate, "wall_sec": native_sec,
+                "speedup": 1., "median_error_vs_native_ms": 0., "max_error_vs_native_ms": 0.,
+                "f_measure_vs_native": 1., "f_measure_vs_truth": synth.beat_f_measure(native_beats, true_beat_times)}]
+    for target_sampling_rate in args.target_sampling_rates:
+        beats, wall_sec = track_beats(audio_path, target_sampling_rate)
+        errors = synth.beat_time_errors(beats, native_beats) if len(beats) and len(native_beats) > 1 \
+            else np.array([np.nan])
+        results.append({"case": case_name, "sampling_rate": target_sampling_rate, "wall_sec": wall_sec,
+                        "speedup": native_sec / wall_sec,
+                        "median_error_vs_native_ms": float(np.median(errors) * 1000),
+                        "max_error_vs_native_ms": float(np.max(errors) * 1000),
+                        "f_measure_vs_native": synth.beat_f_measure(beats, native_beats, tolerance_sec=0.02),
+                        "f_measure_vs_truth": synth.beat_f_measure(beats, true_beat_times)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark resampling before beat tracking")
+    parser.add_argument("--native_sampling_rate", help="Sampling rate of the synthetic audio", type=int,
+                        default=48000)
+    parser.add_argument("--target_sampling_rates", help="Beat tracking sampling rates to compare", type=int,
+                        nargs="+", default=[44100, 32000, 22050, 16000, 11025])
+    parser.add_argument("--duration_sec", help="Duration of each synthetic song", type=float, default=180.)
+    parser.add_argument("--resampler_only", help="Only time the resampler itself, which doesn't need the Vamp "
+                                                 "plugin", action="store_true")
+    parser.add_argument("--output_json", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    resampler_results = []
+    print("Resampler throughput from {} Hz:".format(args.native_sampling_rate))
+    for target_sampling_rate in args.target_sampling_rates:
+        result = benchmark_resampler(args.native_sampling_rate, target_sampling_rate, args.duration_sec)
+        resampler_results.append(result)
+        print("    to {:>6} Hz: {:7.3f} s for {:.0f} s of audio ({:.1f} M input samples/s)".format(
+            target_sampling_rate, result["wall_sec"], args.duration_sec, result["input_samples_per_sec"] / 1e6))
+
+    beat_tracking_results = []
+    if not args.resampler_only:
+        with tempfile.TemporaryDirectory() as work_dir:
+            for map_name, tempo_map in synth.TEMPO_MAPS.items():
+                case_results = benchmark_case(map_name, tempo_map(args.duration_sec), args.duration_sec,
+                                              pathlib.Path(work_dir), args)
+                beat_tracking_results.extend(case_results)
+                print("{}:".format(map_name))
+                for result in case_results:
+                    print("    {:>6} Hz: {:7.3f} s ({:5.2f}x), beat error vs native median {:6.3f} ms, "
+                          "max {:7.3f} ms, F-measure vs native {:.3f}, vs truth {:.3f}".format(
+                              result["sampling_rate"], result["wall_sec"], result["speedup"],
+                              result["median_error_vs_native_ms"], result["max_error_vs_native_ms"],
+                              result["f_measure_vs_native"], result["f_measure_vs_truth"]))
+
+    if args.output_json is not None:
+        with open(args.output_json, "w") as outfile:
+            json.dump({"args": vars(args), "resampler": resampler_results, "beat_tracking": beat_tracking_results},
+                      outfile, indent=2)
+
+
+if __name__ == "__main__":
+    main()
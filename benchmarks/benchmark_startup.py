@@ -0,0 +1,103 @@
+"""
+Benchmark the startup time of the beats CSV -> #OFFSET/#BPMS text workflow, which is called many times from
+editor tooling, against the cost of eagerly importing the audio dependencies (vamp, soundfile, simfile).
+
+Sample command:
+    python3 benchmarks/benchmark_startup.py --repeats 20
+"""
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = pathlib.Path(__file__).resolve().parent.parent
+SCRIPT_PATH = REPO_DIR / "autogen_simfile_bpms.py"
+AUDIO_MODULES = ["vamp", "soundfile", "simfile"]
+
+
+def _time_command(command: list, repeats: int) -> dict:
+    wall_secs = []
+    for _ in range(repeats):
+        start_wall = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       cwd=str(REPO_DIR))
+        wall_secs.append(time.perf_counter() - start_wall)
+    return {"median_sec": statistics.median(wall_secs), "min_sec": min(wall_secs), "max_sec": max(wall_secs)}
+
+
+def _python_command(code: str) -> list:
+    return [sys.executable, "-c", code]
+
+
+def _audio_modules_loaded_by_csv_run(beats_path: pathlib.Path, txt_path: pathlib.Path) -> list:
+    code = ("import runpy, sys; sys.argv = [{!r}, '--input_beats_path', {!r}, '--output_txt_path', {!r}]; "
+            "runpy.run_path({!r}, run_name='__main__'); "
+            "print('loaded:' + ','.join(m for m in {!r} if m in sys.modules))").format(
+        str(SCRIPT_PATH), str(beats_path), str(txt_path), str(SCRIPT_PATH), AUDIO_MODULES)
+    output = subprocess.run(_python_command(code), check=True, capture_output=True, text=True, cwd=str(REPO_DIR))
+    loaded_line = [line for line in output.stdout.splitlines() if line.startswith("loaded:")][-1]
+    return [module for module in loaded_line[len("loaded:"):].split(",") if module]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of the beats CSV workflow")
+    parser.add_argument("--repeats", help="Number of runs of each command", type=int, default=10)
+    parser.add_argument("--num_beats", help="Number of beats in the synthetic beats CSV", type=int, default=400)
+    parser.add_argument("--output_json", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        beats_path = pathlib.Path(work_dir) / "beats.csv"
+        txt_path = pathlib.Path(work_dir) / "beats.txt"
+        with open(beats_path, "w") as outfile:
+            outfile.write("".join("{:.6f},{}\n".format(0.5 + beat * 0.5, beat % 4 + 1)
+                                  for beat in range(args.num_beats)))
+        csv_command = [sys.executable, str(SCRIPT_PATH), "--input_beats_path", str(beats_path),
+                       "--output_txt_path", str(txt_path)]
+
+        results["python_startup"] = _time_command(_python_command("pass"), args.repeats)
+        results["import_numpy"] = _time_command(_python_command("import numpy"), args.repeats)
+        for module in AUDIO_MODULES:
+            try:
+                results["import_" + module] = _time_command(_python_command("import " + module), args.repeats)
+            except subprocess.CalledProcessError:
+                print("Could not import {}, skipping it".format(module))
+        results["import_autogen_simfile_bpms"] = _time_command(_python_command("import autogen_simfile_bpms"),
+                                                               args.repeats)
+        results["csv_to_txt"] = _time_command(csv_command, args.repeats)
+        # What the CSV workflow cost when the audio dependencies were imported at module load
+        eager_imports = "; ".join("import " + module for module in AUDIO_MODULES)
+        try:
+            results["eager_audio_imports"] = _time_command(_python_command(eager_imports), args.repeats)
+        except subprocess.CalledProcessError:
+            print("Could not import all of {}, skipping the eager import comparison".format(AUDIO_MODULES))
+        results["audio_modules_loaded_by_csv_to_txt"] = _audio_modules_loaded_by_csv_run(beats_path, txt_path)
+
+    for name, result in results.items():
+        if isinstance(result, dict):
+            print("{:<30} median {:7.1f} ms  (min {:7.1f} ms, max {:7.1f} ms)".format(
+                name, result["median_sec"] * 1000, result["min_sec"] * 1000, result["max_sec"] * 1000))
+    print("Audio modules loaded by the CSV workflow: {}".format(
+        ", ".join(results["audio_modules_loaded_by_csv_to_txt"]) or "none"))
+    if "eager_audio_imports" in results:
+        # Both commands pay for starting Python and importing numpy, so count that once
+        eager_sec = results["csv_to_txt"]["median_sec"] + results["eager_audio_imports"]["median_sec"] - \
+            results["import_numpy"]["median_sec"]
+        print("CSV workflow: {:.1f} ms now vs about {:.1f} ms with eager audio imports ({:.0f}% of the time)".format(
+            results["csv_to_txt"]["median_sec"] * 1000, eager_sec * 1000,
+            100 * results["csv_to_txt"]["median_sec"] / eager_sec))
+
+    if args.output_json is not None:
+        with open(args.output_json, "w") as outfile:
+            json.dump({"args": vars(args), "results": results}, outfile, indent=2)
+    if results["audio_modules_loaded_by_csv_to_txt"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
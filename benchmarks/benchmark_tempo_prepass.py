@@ -0,0 +1,104 @@
+"""
+Benchmark the constant tempo pre-pass (--tempo_prepass) against running the beat tracker on every song, over a
+set of synthetic songs: which path each song takes, the wall time of each run, and for the songs that skip the
+beat tracker, how far the estimated tempo and offset are from the ground truth.
+
+Sample command:
+    python3 benchmarks/benchmark_tempo_prepass.py --duration_sec 240 --bpms 90 128 174
+"""
+import argparse
+import json
+import pathlib
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from autogen_simfile_bpms import AudioBeatsToBPMs, ConstantTempoEstimator  # noqa: E402
+import synthetic_tempo_maps as synth  # noqa: E402
+
+
+MAX_BPM_ERROR = 0.01  # Largest error of a song's tempo estimate against the truth to pass
+MAX_OFFSET_ERROR_MS = 5.
+
+
+def run_song(audio_path: pathlib.Path, **kwargs) -> tuple:
+    atbpm = AudioBeatsToBPMs(input_audio_path=audio_path, interactive=False, use_cache=False, **kwargs)
+    start_wall = time.perf_counter()
+    atbpm.run()
+    return atbpm, time.perf_counter() - start_wall
+
+
+def benchmark_song(song_name: str, true_beat_times: np.ndarray, args, work_dir: pathlib.Path) -> dict:
+    audio_path = work_dir / "{}.wav".format(song_name)
+    synth.write_click_track(audio_path, true_beat_times, args.duration_sec)
+    _, plugin_sec = run_song(audio_path)
+    atbpm, prepass_sec = run_song(audio_path, tempo_prepass=True,
+                                  tempo_prepass_unstable_regions_only=args.unstable_regions_only)
+    true_periods = np.diff(true_beat_times)
+    result = {"song": song_name, "path": atbpm.beat_tracking_path, "plugin_wall_sec": plugin_sec,
+              "prepass_wall_sec": prepass_sec, "speedup": plugin_sec / prepass_sec,
+              "stages": atbpm.metrics.stages, "tempo_prepass": atbpm.tempo_prepass_report,
+              "f_measure_vs_truth": synth.beat_f_measure(atbpm.beats_timestamp_data.timestamps, true_beat_times),
+              "bpm_error": None, "offset_error_ms": None}
+    if atbpm.beat_tracking_path == "tempo_prepass":
+        result["bpm_error"] = float(abs(atbpm.bpms_data.bpms[0] - 60. / np.mean(true_periods)))
+        result["offset_error_ms"] = float(abs(atbpm.offset + true_beat_times[0]) * 1000)
+        # A song with tempo changes must never skip the beat tracker
+        result["ok"] = bool(np.ptp(true_periods) < 1e-6 and result["bpm_error"] <= MAX_BPM_ERROR
+                            and result["offset_error_ms"] <= MAX_OFFSET_ERROR_MS)
+    else:
+        result["ok"] = True
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the constant tempo pre-pass")
+    parser.add_argument("--duration_sec", help="Duration of each synthetic song", type=float, default=180.)
+    parser.add_argument("--bpms", help="Tempos of the steady synthetic songs", type=float, nargs="+",
+                        default=[72., 100., 128., 150., 175., 200.])
+    parser.add_argument("--unstable_regions_only", help="Only run the beat tracker on the unstable regions of the "
+                                                        "songs that don't skip it",
+                        action="store_true")
+    parser.add_argument("--output_json", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    songs = {"steady_{:g}".format(bpm): synth.steady_beat_times(bpm=bpm, duration_sec=args.duration_sec)
+             for bpm in args.bpms}
+    songs.update({"stepped": synth.stepped_beat_times(duration_sec=args.duration_sec),
+                  "ramped": synth.ramped_beat_times(duration_sec=args.duration_sec)})
+    # Steady until near the end, so that only the last region shows the tempo change
+    change_sec = args.duration_sec - 0.5 * ConstantTempoEstimator.REGION_SEC
+    songs["late_change"] = np.concatenate((np.arange(0.5, change_sec, 0.5),
+                                           np.arange(change_sec, args.duration_sec, 0.4)))
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for song_name, true_beat_times in songs.items():
+            result = benchmark_song(song_name, true_beat_times, args, pathlib.Path(work_dir))
+            results.append(result)
+            print("{:<12} {:<25} confidence {:.3f}, {:7.2f} s -> {:7.2f} s ({:5.2f}x), BPM error {}, offset "
+                  "error {}, F-measure vs truth {:.3f}: {}".format(
+                      result["song"], result["path"], result["tempo_prepass"]["confidence"],
+                      result["plugin_wall_sec"], result["prepass_wall_sec"], result["speedup"],
+                      "{:.4f}".format(result["bpm_error"]) if result["bpm_error"] is not None else "-",
+                      "{:.2f} ms".format(result["offset_error_ms"]) if result["offset_error_ms"] is not None
+                      else "-", result["f_measure_vs_truth"], "ok" if result["ok"] else "FAILED"))
+
+    plugin_sec = sum(result["plugin_wall_sec"] for result in results)
+    prepass_sec = sum(result["prepass_wall_sec"] for result in results)
+    print("All songs: {:.2f} s with the beat tracker, {:.2f} s with the pre-pass ({:.2f}x faster), "
+          "{} of {} songs skipped the beat tracker".format(
+              plugin_sec, prepass_sec, plugin_sec / prepass_sec,
+              sum(result["path"] == "tempo_prepass" for result in results), len(results)))
+
+    if args.output_json is not None:
+        with open(args.output_json, "w") as outfile:
+            json.dump({"args": vars(args), "results": results}, outfile, indent=2)
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
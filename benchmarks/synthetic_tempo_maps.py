@@ -0,0 +1,130 @@
+import pathlib
+
+import numpy as np
+import soundfile as sf
+
+
+BEATS_PER_BAR = 4
+CLICK_DURATION_SEC = 0.08
+
+
+def steady_beat_times(bpm: float = 120., duration_sec: float = 180., first_beat_sec: float = 0.5) -> np.ndarray:
+    return first_beat_sec + np.arange(0., duration_sec - first_beat_sec, 60. / bpm)
+
+
+def stepped_beat_times(bpms=(120., 150., 96., 132.), beats_per_step: int = 64, duration_sec: float = 180.,
+                       first_beat_sec: float = 0.5) -> np.ndarray:
+    max_num_beats = int((duration_sec - first_beat_sec) * max(bpms) / 60.) + 1
+    step_periods = 60. / np.asarray(bpms, dtype=np.float64)
+    periods = step_periods[(np.arange(max_num_beats) // beats_per_step) % len(step_periods)]
+    beat_times = first_beat_sec + np.concatenate(([0.], np.cumsum(periods)))
+    return beat_times[beat_times < duration_sec]
+
+
+def ramped_beat_times(start_bpm: float = 100., end_bpm: float = 160., duration_sec: float = 180.,
+                      first_beat_sec: float = 0.5) -> np.ndarray:
+    # The tempo ramps linearly in time from the first beat, so beat k is at the root of
+    # k = (start_bpm * t + (end_bpm - start_bpm) * t ** 2 / (2 * ramp_sec)) / 60
+    ramp_sec = duration_sec - first_beat_sec
+    a = (end_bpm - start_bpm) / (2 * ramp_sec * 60.)
+    b = start_bpm / 60.
+    num_beats = int(b * ramp_sec + a * ramp_sec ** 2) + 1
+    beat_indices = np.arange(num_beats)
+    if a == 0.:
+        return first_beat_sec + beat_indices / b
+    return first_beat_sec + (-b + np.sqrt(b ** 2 + 4 * a * beat_indices)) / (2 * a)
+
+
+TEMPO_MAPS = {
+    "steady": lambda duration_sec: steady_beat_times(duration_sec=duration_sec),
+    "stepped": lambda duration_sec: stepped_beat_times(duration_sec=duration_sec),
+    "ramped": lambda duration_sec: ramped_beat_times(duration_sec=duration_sec),
+}
+
+
+def beat_labels(num_beats: int) -> np.ndarray:
+    return (np.arange(num_beats) % BEATS_PER_BAR + 1).astype(str)
+
+
+def synthesize_click_track(beat_times: np.ndarray, duration_sec: float, sampling_rate: int = 44100,
+                           channels: int = 2) -> np.ndarray:
+    """
+    A drum-like click at every beat: a decaying low sine (kick) plus a noise burst, with louder and higher
+    clicks on the downbeats so the bar tracker can find the bars.
+
+    :return: audio as a float32 [samples, channels] array, as soundfile writes it
+    """
+    rng = np.random.default_rng(0)
+    click_times = np.arange(int(CLICK_DURATION_SEC * sampling_rate)) / sampling_rate
+    envelope = np.exp(-click_times * 40.)
+    kick = np.sin(2 * np.pi * 60. * click_times) * envelope
+    noise = rng.uniform(-1., 1., len(click_times)) * np.exp(-click_times * 120.)
+    downbeat_click = (0.9 * kick + 0.5 * noise + 0.3 * np.sin(2 * np.pi * 1500. * click_times) * envelope)
+    beat_click = 0.6 * kick + 0.3 * noise
+
+    audio = np.zeros(int(duration_sec * sampling_rate), dtype=np.float32)
+    for beat_index, beat_sec in enumerate(beat_times):
+        start = int(round(beat_sec * sampling_rate))
+        click = downbeat_click if beat_index % BEATS_PER_BAR == 0 else beat_click
+        end = min(start + len(click), len(audio))
+        audio[start:end] += click[:end - start]
+    audio += rng.normal(0., 1e-3, len(audio)).astype(np.float32)  # A little noise floor so nothing is digital silence
+    return np.repeat(audio[:, np.newaxis], channels, axis=1)
+
+
+def write_click_track(path, beat_times: np.ndarray, duration_sec: float, sampling_rate: int = 44100,
+                      channels: int = 2):
+    sf.write(str(path), synthesize_click_track(beat_times, duration_sec, sampling_rate, channels), sampling_rate)
+
+
+def write_beats_csv(path, beat_times: np.ndarray, sampling_rate: int = None):
+    # In seconds, or in samples if a sampling rate is given (for --input_beats_sampling_rate)
+    timestamps = np.round(beat_times * sampling_rate).astype(np.int64).astype(str) if sampling_rate is not None \
+        else np.char.mod("%.9f", beat_times)
+    with open(path, "w") as outfile:
+        outfile.write("".join("{},{}\n".format(timestamp, label)
+                              for timestamp, label in zip(timestamps, beat_labels(len(beat_times)))))
+
+
+def write_simfile(path, music_filename: str, num_charts: int = 5, num_measures: int = 500):
+    path = pathlib.Path(path)
+    measure = "1000\n0100\n0010\n0001\n"
+    note_data = ",\n".join([measure] * num_measures)
+    difficulties = ["Beginner", "Easy", "Medium", "Hard", "Challenge"]
+    with open(path, "w") as outfile:
+        outfile.write("#TITLE:Benchmark {};\n#ARTIST:autogen_simfile_bpms;\n#MUSIC:{};\n#OFFSET:0.000;\n"
+                      "#BPMS:0.000=120.000;\n#STOPS:;\n".format(path.stem, music_filename))
+        for chart_index in range(num_charts):
+            outfile.write("\n//---------------dance-single - ----------------\n#NOTES:\n     dance-single:\n     :\n"
+                          "     {}:\n     {}:\n     0,0,0,0,0:\n{};\n".format(
+                              difficulties[chart_index % len(difficulties)], chart_index + 1, note_data))
+
+
+def timing_beat_times(offset: float, beat_markers: np.ndarray, bpms: np.ndarray, num_beats: int) -> np.ndarray:
+    """
+    The beat times that an #OFFSET and #BPMS pair puts the first num_beats beats at (ignoring stops).
+    """
+    beat_markers = np.asarray(beat_markers, dtype=np.int64)
+    bpms = np.asarray(bpms, dtype=np.float64)
+    if num_beats < 2 or len(bpms) == 0:
+        return np.full(min(num_beats, 1), -offset)
+    segment_lengths = np.diff(np.append(beat_markers, num_beats - 1))
+    periods = np.repeat(60. / bpms, np.maximum(segment_lengths, 0))
+    return -offset + np.concatenate(([0.], np.cumsum(periods)))
+
+
+def beat_time_errors(estimated_beat_times: np.ndarray, true_beat_times: np.ndarray) -> np.ndarray:
+    # Distance from each estimated beat to the nearest true beat
+    indices = np.clip(np.searchsorted(true_beat_times, estimated_beat_times), 1, len(true_beat_times) - 1)
+    return np.minimum(np.abs(estimated_beat_times - true_beat_times[indices - 1]),
+                      np.abs(estimated_beat_times - true_beat_times[indices]))
+
+
+def beat_f_measure(estimated_beat_times: np.ndarray, true_beat_times: np.ndarray, tolerance_sec: float = 0.07):
+    if len(estimated_beat_times) == 0 or len(true_beat_times) == 0:
+        return 0.
+    num_hits = min(int(np.sum(beat_time_errors(estimated_beat_times, true_beat_times) <= tolerance_sec)),
+                   len(true_beat_times))
+    precision = num_hits / len(estimated_beat_times)
+    recall = num_hits / len(true_beat_times)
+    return 2 * precision * recall / (precision + recall) if num_hits else 0.